@@ -4,6 +4,11 @@
 #include "../_components/timing_functions.h"
 #endif
 
+#ifdef CONFIG_OBSERVER_BINARY_FRAMES
+#include <stddef.h>
+#include "driver/uart.h"
+#endif
+
 static const char* TAG1 = "EDGE_DETECT";
 
 typedef enum {
@@ -19,6 +24,32 @@ typedef struct {
 
 static QueueHandle_t gpio_evt_queue = NULL;
 
+#ifdef CONFIG_OBSERVER_BINARY_FRAMES
+// binary frame sent per edge, decoded by python_utils/obsv_frames.py
+#define FRAME_SYNC_0 0xA5
+#define FRAME_SYNC_1 0x5A
+
+typedef struct __attribute__((packed)) {
+    uint8_t  sync[2];                           // FRAME_SYNC_0, FRAME_SYNC_1
+    uint8_t  gpio_num;                          // gpio that triggered the event
+    uint8_t  edge;                              // event_id_t, 0 = rising, 1 = falling
+    int64_t  timestamp;                         // systime in us, little endian
+    uint16_t crc;                               // CRC-16/CCITT-FALSE over gpio_num, edge and timestamp
+} obsv_frame_t;
+
+static uint16_t crc16_ccitt(const uint8_t* data, size_t len)
+{
+    uint16_t crc = 0xFFFF;
+    for (size_t i = 0; i < len; i++){
+        crc ^= (uint16_t)data[i] << 8;
+        for (uint8_t bit = 0; bit < 8; bit++){
+            crc = (crc & 0x8000) ? (uint16_t)((crc << 1) ^ 0x1021) : (uint16_t)(crc << 1);
+        }
+    }
+    return crc;
+}
+#endif
+
 // list of usable input pins
 #define PIN_AMOUNT 7
 static const gpio_num_t gpio_list[PIN_AMOUNT] = {18, 19, 21, 22, 23, 32, 33};
@@ -47,6 +78,16 @@ static void observer_task(void* arg)
     gpio_event_t evt;
     while (xQueueReceive(gpio_evt_queue, &evt, portMAX_DELAY) == pdTRUE) {     // get event from queue        
         
+#ifdef CONFIG_OBSERVER_BINARY_FRAMES
+        obsv_frame_t frame = {
+            .sync      = {FRAME_SYNC_0, FRAME_SYNC_1},
+            .gpio_num  = (uint8_t) evt.gpio_num,
+            .edge      = (uint8_t) evt.id,
+            .timestamp = evt.timestamp,
+        };
+        frame.crc = crc16_ccitt(&frame.gpio_num, offsetof(obsv_frame_t, crc) - offsetof(obsv_frame_t, gpio_num));
+        uart_write_bytes(CONFIG_ESP_CONSOLE_UART_NUM, &frame, sizeof(frame));   // raw write, stdout would translate 0x0A bytes to CRLF
+#else
         if(evt.id == RISING_EDGE){
             printf("GPIO%d EDGE RISING  %lld \n", evt.gpio_num, evt.timestamp);
             fflush(stdout);  
@@ -55,6 +96,7 @@ static void observer_task(void* arg)
             printf("GPIO%d EDGE FALLING %lld \n", evt.gpio_num, evt.timestamp);   
             fflush(stdout);
         }
+#endif
     }
 }
 
@@ -81,6 +123,11 @@ static void init(){
         ESP_ERROR_CHECK( gpio_isr_handler_add(gpio_list[i], gpio_isr_handler, (void*)gpio_list[i]) );
     }
 
+#ifdef CONFIG_OBSERVER_BINARY_FRAMES
+    // the uart driver is needed for raw binary writes on the console uart
+    ESP_ERROR_CHECK( uart_driver_install(CONFIG_ESP_CONSOLE_UART_NUM, 256, 1024, 0, NULL, 0) );
+#endif
+
     // create a queue to handle gpio event from isrs
     gpio_evt_queue = xQueueCreate(PIN_AMOUNT*3, sizeof(gpio_event_t));
 
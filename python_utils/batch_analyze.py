@@ -0,0 +1,218 @@
+import sys
+import os
+import csv
+import json
+import glob
+import re
+import time
+import matplotlib
+matplotlib.use('Agg')                                                   # headless, also in the worker processes which import this module again
+import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from capture import capture_reader, capture_ports
+from sync_analyzer import cycle_analyzer
+from obsv_frames import edge_events, edge_rising
+from summary_cache import summary_cache
+import plot_sync_data as sync
+import plot_coding_data as coding
+
+#
+# Re-analyzes recorded runs offline, one worker process per run.
+# Run:
+# `python batch_analyze.py [RUN ...]`      # run directories holding a capture.log (plot_sync_data -save -record) or capture files,
+#                                          # without any every capture.log below .\export
+# optional: -jobs N worker processes (default: one per core)
+#           -measure N window size of the analysis, same meaning as plot_sync_data -measure (default 10000)
+#           -out DIR where the figures (DIR\<run>\) and summary.csv / summary.json go (default .\export\batch)
+#           -nofig only the summary, no figures
+#           -force analyze every run again, even if its summary is up to date
+# Every capture is replayed through the same parsers and statistics as the live tools (plot_sync_data or plot_coding_data,
+# taken from the capture header), the figures are rendered with the Agg backend. The summary row of every run is cached
+# next to its capture (summary_cache.py, keyed by the capture hash, the analysis version and -measure), so only new or
+# changed runs are analyzed again.
+# The CONFIG parameters of a run (from the capture, or from the run directory name) become columns of the summary.
+#
+
+export_dir   = sync.export_dir                                          # where plot_sync_data -save puts its runs
+capture_name = 'capture.log'
+summary_name = 'summary'
+first_fields = ['run', 'tool', 'config', 'lines', 'seconds', 'error']  # leading csv columns, the statistics follow in order of appearance
+run_date     = re.compile(r'_\d{4}-\d{2}-\d{2}$')                       # date plot_sync_data -save appends to the CONFIG token
+config_field = re.compile(r'([A-Za-z_]+?)_(-?\d+)$')                    # 'TS_senddelay_20' -> ('TS_senddelay', '20')
+
+def config_fields(config):                                              # CONFIG token of the peers -> {'bc_duration': 500, 'TS_senddelay': 20, ...}
+    fields = {}
+    for part in config.split('-'):
+        match = config_field.match(part)
+        if match:
+            fields[match.group(1)] = int(match.group(2))
+    return fields
+
+def find_captures(paths):                                               # run name -> capture file
+    if not paths:
+        paths = glob.glob(os.path.join(export_dir, '**', capture_name), recursive=True)
+    captures = {}
+    for path in paths:
+        if os.path.isdir(path):
+            path = os.path.join(path, capture_name)
+        name = os.path.basename(os.path.dirname(os.path.abspath(path))) if os.path.basename(path) == capture_name else os.path.splitext(os.path.basename(path))[0]
+        captures[name] = path
+    return captures
+
+def analyze_sync(reader, measure_cnt, fig_dir):
+    sync.verbose = False
+    peer_names   = sorted((port for port in capture_ports(reader.path) if port.startswith('peer')), key=lambda name: int(name[4:]))
+    analyzer     = cycle_analyzer(measure_cnt, bins=2*sync.hist_bins, verbose=False)
+    peers        = {name: sync.peer_state(name, measure_cnt) for name in peer_names}
+    config       = ''
+
+    for port, host_time, line in reader:
+        if port == 'obsv':
+            for gpio, edge, timestamp in edge_events([line]):
+                if edge == edge_rising:
+                    analyzer.rising(gpio, timestamp)
+                else:
+                    analyzer.falling()
+        elif port in peers:
+            event = sync.process_peer_line(line, host_time, peers[port])
+            if port == 'peer1' and event is not None:
+                if event[0] == 'peer_config' and not config:
+                    config = event[1]
+                if event[0] == 'peer_reset':                            # the live tool stops here as well
+                    break
+
+    summary = {'config': config}
+    summary.update(sync.sync_summary(analyzer, list(peers.values())))
+
+    if fig_dir:
+        views = sync.init_figures(peer_names, analyzer.gpios)
+        sync.refresh_deviation_plot(views['deviation'], analyzer.spread)
+        sync.refresh_pairwise_plot(views['pairs'], analyzer)
+        sync.refresh_offset_drift_plot(views['offset'], views['drift'], list(peers.values()))
+        sync.refresh_api_plot(views['api'], list(peers.values()))
+        sync.save_figures(views, fig_dir)
+        sync.close_figures(views)
+    return summary
+
+def analyze_coding(reader, fig_dir):
+    relay   = coding.relay_node('relay')
+    natives = {port: coding.native_node(port) for port in capture_ports(reader.path) if port != 'relay'}
+
+    for port, host_time, line in reader:
+        if port == 'relay':
+            coding.update_relay(relay, line)
+        elif port in natives:
+            coding.update_native(natives[port], line)
+
+    native_nodes = list(natives.values())
+    summary      = coding.coding_summary(relay, native_nodes)
+
+    if fig_dir:
+        fig_coding, (trans_ax, gain_ax) = plt.subplots(2, 1, figsize=(10, 6), sharex=False)
+        fig_report, report_ax           = plt.subplots(figsize=(10, 6))
+        coding_view = coding.init_relay_coding_plot(fig_coding, trans_ax, gain_ax, len(native_nodes))
+        report_view = coding.init_relay_report_plot(fig_report, report_ax, len(native_nodes))
+        coding.update_relay_coding_plot(coding_view, relay, len(native_nodes))
+        coding.update_relay_report_plot(report_view, relay, len(native_nodes))
+        coding_view.savefig(os.path.join(fig_dir, 'coding_gain_relay.png'))
+        report_view.savefig(os.path.join(fig_dir, 'reception_report.png'))
+        plt.close(fig_coding)
+        plt.close(fig_report)
+    return summary
+
+def analyze_run(name, path, measure_cnt, out_dir, figures):             # runs in a worker process, returns one summary row
+    start   = time.perf_counter()
+    summary = {'run': name}
+    run_dir = os.path.join(out_dir, name)
+    try:
+        reader  = capture_reader(path)
+        fig_dir = run_dir if figures else ''
+        if fig_dir:
+            os.makedirs(fig_dir, exist_ok=True)
+        summary['tool'] = reader.tool
+        if reader.tool == 'plot_sync_data':
+            summary.update(analyze_sync(reader, measure_cnt, fig_dir))
+        elif reader.tool == 'plot_coding_data':
+            summary.update(analyze_coding(reader, fig_dir))
+        else:
+            raise ValueError('no analysis for captures of ' + reader.tool)
+        summary['lines'] = reader.count
+        reader.close()
+    except Exception as ex:                                             # one broken capture must not take the whole batch down
+        summary['error'] = repr(ex)
+        return summary
+    summary['measure_cnt'] = measure_cnt
+    summary['config'] = summary.get('config') or run_date.sub('', name)
+    summary.update(config_fields(summary['config']))
+    summary['seconds'] = round(time.perf_counter() - start, 3)
+    summary_cache(path).put({'measure_cnt': measure_cnt}, summary)
+    return summary
+
+def cached_summary(name, path, out_dir, measure_cnt, figures):          # summary row of an earlier, equal analysis, None if there is none
+    if figures and not glob.glob(os.path.join(out_dir, name, '*.png')):
+        return None
+    summary = summary_cache(path).get({'measure_cnt': measure_cnt})
+    if summary is not None:
+        summary['run'] = name                                           # the same capture may be listed under another name
+    return summary
+
+def summarize(captures, out_dir, measure_cnt=10000, jobs=None, figures=True, force=False):   # run name -> summary row, analyzes only what is not cached
+    rows    = {}
+    pending = {}
+    for name, path in captures.items():
+        row = None if force else cached_summary(name, path, out_dir, measure_cnt, figures)
+        if row is not None:
+            rows[name] = row
+        else:
+            pending[name] = path
+    if not pending:
+        return rows
+
+    with ProcessPoolExecutor(max_workers=min(jobs or os.cpu_count(), len(pending))) as pool:
+        futures = [pool.submit(analyze_run, name, path, measure_cnt, out_dir, figures) for name, path in pending.items()]
+        for future in as_completed(futures):
+            row = future.result()
+            rows[row['run']] = row
+            print('%-60s %s' % (row['run'], row.get('error', '%d lines in %.1f s' % (row.get('lines', 0), row.get('seconds', 0)))))
+    return rows
+
+def write_summary(rows, out_dir, name=summary_name):
+    fields = list(first_fields)
+    for row in rows:
+        fields += [field for field in row if field not in fields]
+
+    with open(os.path.join(out_dir, name + '.csv'), 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+    with open(os.path.join(out_dir, name + '.json'), 'w') as file:
+        json.dump(rows, file, indent=1)
+
+def parse_args(args):                                                  # options shared with sweep_report, returns (paths, options)
+    args    = list(args)
+    options = {'jobs':        int(args[args.index('-jobs')+1])    if '-jobs'    in args else os.cpu_count(),
+               'measure_cnt': int(args[args.index('-measure')+1]) if '-measure' in args else 10000,
+               'out_dir':     args[args.index('-out')+1]          if '-out'     in args else os.path.join(export_dir, 'batch'),
+               'figures':     '-nofig' not in args,
+               'force':       '-force' in args}
+    for option in ['-jobs', '-measure', '-out']:
+        if option in args: del args[args.index(option):args.index(option)+2]
+    return [arg for arg in args if arg not in ['-nofig', '-force']], options
+
+def main():
+    paths, options = parse_args(sys.argv[1:])
+    captures = find_captures(paths)
+    if not captures:
+        print('no captures found')
+        return
+    out_dir = options.pop('out_dir')
+    os.makedirs(out_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    rows  = summarize(captures, out_dir, **options)
+    rows  = [rows[name] for name in sorted(rows)]
+    write_summary(rows, out_dir)
+    print('summarized %d runs in %.1f s, summary in %s' % (len(rows), time.perf_counter() - start, os.path.join(out_dir, summary_name + '.csv')))
+
+if __name__ == '__main__':
+    main()
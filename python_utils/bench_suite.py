@@ -0,0 +1,375 @@
+import sys
+import os
+import json
+import time
+import random
+import platform
+import subprocess
+import multiprocessing
+import numpy as np
+import matplotlib
+from concurrent.futures import ProcessPoolExecutor
+from batch_analyze import export_dir                                    # also selects the Agg backend
+from capture import capture_reader
+from sync_analyzer import cycle_analyzer, obsv_gpios
+from obsv_frames import edge_events, edge_rising, edge_falling, format_edge_line
+from live_plot import minmax_decimate
+import matplotlib.pyplot as plt
+import plot_sync_data as sync
+import plot_coding_data as coding
+
+try:
+    import resource                                                     # not available on Windows, peak RSS is reported as None there
+except ImportError:
+    resource = None
+
+#
+# End-to-end benchmark of the parse, compute and render stages of plot_sync_data and plot_coding_data.
+# Run:
+# `python bench_suite.py`                  # synthetic logs, results in .\export\bench\bench_<commit>.json
+# `python bench_suite.py -compare OLD.json` # same, then the change of every metric against an earlier result
+# `python bench_suite.py -compare OLD.json NEW.json` # only the comparison of two stored results
+# optional: -windows 100,1000,...  window sizes (-measure of plot_sync_data / encoded broadcasts of the relay, default 100 up to 1M)
+#           -tools sync,coding which tools to benchmark (default both)
+#           -lines N log lines per parse run (default 100000)
+#           -refreshes N timed refreshes per figure and window (default 50)
+#           -peers N / -natives N boards of the synthetic logs (default 2 / 2)
+#           -capture FILE parse a recorded capture instead of synthetic lines (only the tool that recorded it is benchmarked)
+#           -threshold PCT change that counts as a regression in -compare (default 10), the exit code is 1 if any is found
+#           -out FILE where the results go
+# Every (tool, window) runs in a fresh process, so the peak RSS reported for it is not inflated by an earlier window.
+# parse:   lines/s through the same calls as the live loops (update_relay, update_native, the obsv / peer dispatch)
+# compute: latency of the statistics behind a refresh (offset_drift_stats, pair_deviation, the coding gain arrays)
+# render:  latency of every figure refresh on the Agg canvas, one new cycle / broadcast is ingested before each one
+# The state is filled to the window size through the same structures the parsers write to, then -refreshes samples of
+# every function are taken, reported as p50 / p90 / p99 / max in ms.
+#
+
+bench_dir     = os.path.join(export_dir, 'bench')
+default_windows = [100, 1000, 10000, 100000, 1000000]
+cycle_us      = 100000                                                  # synthetic cycle duration
+latency_us    = 2000                                                    # mean host receive latency of the peer lines
+percentiles   = [50, 90, 99]
+higher_better = ['lines_per_s']                                         # every other metric is a time or a size
+compared      = ['lines_per_s', 'p50_ms', 'p99_ms', 'rss_peak_mb']
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss            # kB on Linux, bytes on macOS
+    return round(peak / (1 << 20 if sys.platform == 'darwin' else 1 << 10), 1)
+
+def latency_stats(samples):                                             # seconds -> {p50_ms, p90_ms, p99_ms, max_ms}
+    samples = np.array(samples) * 1e3
+    stats   = {'p%d_ms' % q: round(float(value), 4) for q, value in zip(percentiles, np.percentile(samples, percentiles))}
+    stats['max_ms'] = round(float(samples.max()), 4)
+    return stats
+
+def timed(call):
+    start = time.perf_counter()
+    call()
+    return time.perf_counter() - start
+
+def esp_log(tag, message, i):                                           # esp-idf log layout incl. the color codes the readers strip
+    return 'I (' + str(i*13) + ') ' + tag + ': ' + message
+
+def relay_lines(count):
+    lines = []
+    for i in range(1, count):
+        lines.append(esp_log('CODING', 'Received native packet ' + str(i), i))
+        if i % 2 == 0:  lines.append(esp_log('CODING', 'Encoded packets [ ' + str(i-1) + ' ' + str(i) + ' ]', i))
+        if i % 10 == 0: lines.append(esp_log('RR', 'Received reception report - data_lenght 12 packet_count 10', i))
+        if i % 50 == 0: lines.append(esp_log('CODING', 'Number of retransmissions: ' + str(i % 7), i))
+        if i % 3 == 0:  lines.append(esp_log('wifi', 'station: 24:0a:c4:00:00:01 join, AID=' + str(i % 8), i))
+    return lines
+
+def native_lines(count):
+    lines = []
+    for i in range(1, count):
+        lines.append(esp_log('CODING', 'Commissioned native packet ' + str(i), i))
+        lines.append(esp_log('CODING', 'Received encoded packet', i))
+        lines.append(esp_log('CODING', random.choice(['Decoded packet ', 'Decoded cashed packet ']) + str(i), i))
+        if i % 7 == 0:  lines.append(esp_log('CODING', 'Decoding redundant', i))
+        if i % 11 == 0: lines.append(esp_log('CODING', 'Decoding failed - missing packets', i))
+        if i % 3 == 0:  lines.append(esp_log('wifi', 'station: 24:0a:c4:00:00:01 join, AID=' + str(i % 8), i))
+    return lines
+
+class sync_state:                                                       # the structures the plot_sync_data main loop feeds
+
+    def __init__(self, window, peer_cnt):
+        sync.verbose   = False
+        self.analyzer  = cycle_analyzer(window, bins=2*sync.hist_bins, verbose=False)
+        self.names     = ['peer' + str(i+1) for i in range(peer_cnt)]
+        self.peers     = {name: sync.peer_state(name, window) for name in self.names}
+        self.gpios     = obsv_gpios[:peer_cnt]
+        self.drifts    = np.linspace(-20e-6, 20e-6, peer_cnt)           # spread the peers over +-20 ppm
+        self.rng       = np.random.default_rng(1)
+        self.cycle     = 0
+
+    def cycle_values(self):                                             # (host time [us], rising edges, peer systimes) of the next cycle
+        now    = self.cycle * cycle_us
+        errors = self.drifts * cycle_us + self.rng.normal(0, 5, len(self.gpios))
+        host   = now + latency_us + int(self.rng.integers(0, 500))
+        self.cycle += 1
+        return host, (now + errors).astype(np.int64), (host * (1 + self.drifts)).astype(np.int64)
+
+    def add_cycle(self):                                                # event level, without formatting and parsing text
+        host, rising, systimes = self.cycle_values()
+        for gpio, timestamp in zip(self.gpios, rising.tolist()):
+            self.analyzer.rising(gpio, timestamp)
+        self.analyzer.falling()
+        for i, name in enumerate(self.names):
+            peer = self.peers[name]
+            peer.systime.append(host, int(systimes[i]))
+            peer.send_offsets.append(30 + i)
+            peer.recv_offsets.append(40 + i)
+            if i > 0:
+                peer.comp_offsets.append(host, int(rising[i] - rising[0]))
+
+    def records(self, line_cnt):                                        # (port, host time [ns], lines) batches as the readers deliver them
+        records = []
+        count   = 0
+        while count < line_cnt:
+            host, rising, systimes = self.cycle_values()
+            order = np.argsort(rising)
+            edges = [format_edge_line(self.gpios[i], edge_rising, int(rising[i])) for i in order]
+            edges += [format_edge_line(self.gpios[i], edge_falling, int(rising[i]) + cycle_us // 2) for i in order]
+            records.append(('obsv', host * 1000, edges))
+            for i, name in enumerate(self.names):
+                lines = [esp_log('SYNC', 'Systime at ' + str(systimes[i]), self.cycle)]
+                if i > 0:
+                    lines.append(esp_log('SYNC', 'Offset to master with ' + str(int(rising[i] - rising[0])), self.cycle))
+                lines.append(esp_log('API', 'avg_send_offset = ' + str(30 + i), self.cycle))
+                lines.append(esp_log('API', 'avg_recv_offset = ' + str(40 + i), self.cycle))
+                records.append((name, host * 1000, lines))
+            count += sum(len(record[2]) for record in records[-len(self.names)-1:])
+        return records
+
+    def dispatch(self, records):                                        # the obsv / peer branches of the plot_sync_data main loop
+        analyzer, peers = self.analyzer, self.peers
+        for port, host_time, lines in records:
+            if port == 'obsv':
+                for gpio, edge, timestamp in edge_events(lines):
+                    if edge == edge_rising:
+                        analyzer.rising(gpio, timestamp)
+                    else:
+                        analyzer.falling()
+            elif port in peers:
+                peer = peers[port]
+                for line in lines:
+                    sync.process_peer_line(line, host_time, peer)
+
+def capture_records(path, tool):                                        # (port, host time, [line]) records of a capture of tool
+    reader = capture_reader(path)
+    if reader.tool != tool:
+        reader.close()
+        return None
+    records = [(port, host_time, [line]) for port, host_time, line in reader]
+    reader.close()
+    return records
+
+def bench_sync(window, options):
+    results = []
+    peer_cnt = options['peers']
+
+    # parse: text lines through the main loop dispatch
+    state   = sync_state(window, peer_cnt)
+    records = capture_records(options['capture'], 'plot_sync_data') if options['capture'] else state.records(options['lines'])
+    if records is not None:
+        lines   = sum(len(record[2]) for record in records)
+        seconds = timed(lambda: state.dispatch(records))
+        results.append({'stage': 'parse', 'case': 'sync_dispatch', 'lines': lines, 'lines_per_s': round(lines / seconds)})
+    del records, state
+
+    # compute and render over a window filled at event level
+    state = sync_state(window, peer_cnt)
+    for _ in range(window + 1):
+        state.add_cycle()
+    peers = list(state.peers.values())
+    views = sync.init_figures(state.names, state.analyzer.gpios)
+    renders = {'deviation':    lambda: sync.refresh_deviation_plot(views['deviation'], state.analyzer.spread),
+               'pairs':        lambda: sync.refresh_pairwise_plot(views['pairs'], state.analyzer),
+               'offset_drift': lambda: sync.refresh_offset_drift_plot(views['offset'], views['drift'], peers),
+               'api':          lambda: sync.refresh_api_plot(views['api'], peers)}
+    computes = {'offset_drift_stats': lambda: sync.offset_drift_stats(peers),
+                'pair_deviation':     lambda: state.analyzer.pair_deviation(),
+                'sync_summary':       lambda: sync.sync_summary(state.analyzer, peers)}
+    for render in renders.values():                                     # first full draw of every figure, not timed
+        render()
+
+    samples = {name: [] for name in list(computes) + list(renders)}
+    for _ in range(options['refreshes']):
+        state.add_cycle()
+        for name, call in list(computes.items()) + list(renders.items()):
+            samples[name].append(timed(call))
+    sync.close_figures(views)
+
+    for name in computes:
+        results.append(dict({'stage': 'compute', 'case': name}, **latency_stats(samples[name])))
+    for name in renders:
+        results.append(dict({'stage': 'render', 'case': name}, **latency_stats(samples[name])))
+    return results
+
+def relay_broadcast(relay, index):                                      # one native packet per call, every second one encodes a pair
+    seqnum = index + 1
+    coding.update_relay(relay, 'I (' + str(seqnum) + ') CODING: Received native packet ' + str(seqnum))
+    if seqnum % 2 == 0:
+        coding.update_relay(relay, 'I (' + str(seqnum) + ') CODING: Encoded packets [ ' + str(seqnum-1) + ' ' + str(seqnum) + ' ]')
+        if seqnum % 20 == 0:
+            coding.update_relay(relay, 'I (' + str(seqnum) + ') RR: Received reception report - data_lenght 12 packet_count 10')
+
+def coding_arrays(relay, native_cnt, width):                           # the arrays update_relay_coding_plot hands to matplotlib
+    x_trans = relay.EncTransPerNat.counts()
+    minmax_decimate(x_trans, relay.EncTransPerNat.values(), width)
+    ideal = x_trans / coding.ideal_coding_gain(native_cnt)
+    minmax_decimate(relay.CodGain.counts(), relay.CodGain.values(), width)
+    return ideal
+
+def bench_coding(window, options):
+    results    = []
+    native_cnt = options['natives']
+
+    # parse: relay and native lines through update_relay / update_native
+    records = capture_records(options['capture'], 'plot_coding_data') if options['capture'] else None
+    if records is not None:
+        relay   = coding.relay_node('relay')
+        natives = {}
+        start   = time.perf_counter()
+        for port, host_time, lines in records:
+            if port == 'relay':
+                coding.update_relay(relay, lines[0])
+            else:
+                coding.update_native(natives.setdefault(port, coding.native_node(port)), lines[0])
+        results.append({'stage': 'parse', 'case': 'coding_capture', 'lines': len(records), 'lines_per_s': round(len(records) / (time.perf_counter() - start))})
+    elif not options['capture']:
+        for case, update, node, lines in (('update_relay', coding.update_relay, coding.relay_node('relay'), relay_lines(options['lines'])),
+                                          ('update_native', coding.update_native, coding.native_node('native1'), native_lines(options['lines']))):
+            seconds = timed(lambda: [update(node, line) for line in lines])
+            results.append({'stage': 'parse', 'case': case, 'lines': len(lines), 'lines_per_s': round(len(lines) / seconds)})
+    records = None
+
+    # compute and render over a run of window encoded broadcasts
+    relay = coding.relay_node('relay')
+    index = 0
+    while relay.encCnt < window:
+        relay_broadcast(relay, index)
+        index += 1
+    fig_coding, (trans_ax, gain_ax) = plt.subplots(2, 1, figsize=(10, 6), sharex=False)
+    fig_report, report_ax           = plt.subplots(figsize=(10, 6))
+    coding_view = coding.init_relay_coding_plot(fig_coding, trans_ax, gain_ax, native_cnt)
+    report_view = coding.init_relay_report_plot(fig_report, report_ax, native_cnt)
+    width       = max(int(trans_ax.bbox.width), 1)
+    renders  = {'relay_coding': lambda: coding.update_relay_coding_plot(coding_view, relay, native_cnt),
+                'relay_report': lambda: coding.update_relay_report_plot(report_view, relay, native_cnt)}
+    computes = {'coding_arrays':  lambda: coding_arrays(relay, native_cnt, width),
+                'coding_summary': lambda: coding.coding_summary(relay, [])}
+    for render in renders.values():
+        render()
+
+    samples = {name: [] for name in list(computes) + list(renders)}
+    for _ in range(options['refreshes']):
+        for _ in range(2):                                              # two native packets, one more encoded broadcast
+            relay_broadcast(relay, index)
+            index += 1
+        for name, call in list(computes.items()) + list(renders.items()):
+            samples[name].append(timed(call))
+    plt.close(fig_coding)
+    plt.close(fig_report)
+
+    for name in computes:
+        results.append(dict({'stage': 'compute', 'case': name}, **latency_stats(samples[name])))
+    for name in renders:
+        results.append(dict({'stage': 'render', 'case': name}, **latency_stats(samples[name])))
+    return results
+
+def run_job(tool, window, options):                                     # runs in its own process, the peak RSS belongs to this job only
+    base_rss = peak_rss_mb()
+    start    = time.perf_counter()
+    results  = bench_sync(window, options) if tool == 'sync' else bench_coding(window, options)
+    rss      = peak_rss_mb()
+    for result in results:
+        result.update({'tool': tool, 'window': window, 'rss_base_mb': base_rss, 'rss_peak_mb': rss})
+    return results, time.perf_counter() - start
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'commit': commit, 'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'matplotlib': matplotlib.__version__, 'platform': platform.platform(), 'cpu_count': os.cpu_count()}
+
+def result_key(result):
+    return (result['tool'], result['stage'], result['case'], result['window'])
+
+def compare(old, new, threshold):                                       # prints the change of every metric, returns the number of regressions
+    old_results = {result_key(result): result for result in old['results']}
+    regressions = 0
+    print('\n%s (%s) -> %s (%s)' % (old['environment'].get('commit'), old['environment'].get('date'), new['environment'].get('commit'), new['environment'].get('date')))
+    print('%-7s %-8s %-20s %8s %-12s %12s %12s %8s' % ('tool', 'stage', 'case', 'window', 'metric', 'old', 'new', 'change'))
+    for result in new['results']:
+        previous = old_results.get(result_key(result))
+        if previous is None:
+            continue
+        for metric in compared:
+            if result.get(metric) is None or not previous.get(metric):
+                continue
+            change = (result[metric] - previous[metric]) / previous[metric] * 100
+            worse  = -change if metric in higher_better else change
+            flag   = ' REGRESSION' if worse > threshold else ''
+            regressions += bool(flag)
+            print('%-7s %-8s %-20s %8d %-12s %12g %12g %+7.1f%%%s' % (result['tool'], result['stage'], result['case'], result['window'], metric, previous[metric], result[metric], change, flag))
+    print('%d regressions above %g%%' % (regressions, threshold))
+    return regressions
+
+def load(path):
+    with open(path, 'r') as file:
+        return json.load(file)
+
+def main():
+    args      = sys.argv
+    windows   = [int(w) for w in args[args.index('-windows')+1].split(',')] if '-windows' in args else default_windows
+    tools     = args[args.index('-tools')+1].split(',')       if '-tools'     in args else ['sync', 'coding']
+    threshold = float(args[args.index('-threshold')+1])      if '-threshold' in args else 10
+    old_path  = args[args.index('-compare')+1]               if '-compare'   in args else ''
+    new_path  = args[args.index('-compare')+2]               if '-compare'   in args and len(args) > args.index('-compare')+2 and args[args.index('-compare')+2].endswith('.json') else ''
+    options   = {'lines':     int(args[args.index('-lines')+1])     if '-lines'     in args else 100000,
+                 'refreshes': int(args[args.index('-refreshes')+1]) if '-refreshes' in args else 50,
+                 'peers':     int(args[args.index('-peers')+1])     if '-peers'     in args else 2,
+                 'natives':   int(args[args.index('-natives')+1])   if '-natives'   in args else 2,
+                 'capture':   args[args.index('-capture')+1]        if '-capture'   in args else ''}
+
+    if new_path:                                                        # two stored results, nothing to run
+        sys.exit(1 if compare(load(old_path), load(new_path), threshold) else 0)
+
+    if options['capture']:
+        tool  = capture_reader(options['capture'])
+        tools = [tool.tool.replace('plot_', '').replace('_data', '')]
+        tool.close()
+
+    results = []
+    context = multiprocessing.get_context('spawn')                      # a fresh interpreter per job, as on Windows
+    for tool in tools:
+        for window in windows:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                job_results, seconds = pool.submit(run_job, tool, window, options).result()
+            results += job_results
+            print('%-7s window %8d  %.1f s, peak RSS %s MB' % (tool, window, seconds, job_results[0]['rss_peak_mb']))
+            for result in job_results:
+                if result['stage'] == 'parse':
+                    print('    %-8s %-20s %12d lines/s' % (result['stage'], result['case'], result['lines_per_s']))
+                else:
+                    print('    %-8s %-20s p50 %9.3f  p99 %9.3f  max %9.3f ms' % (result['stage'], result['case'], result['p50_ms'], result['p99_ms'], result['max_ms']))
+
+    report = {'environment': environment(), 'options': options, 'windows': windows, 'results': results}
+    out_path = args[args.index('-out')+1] if '-out' in args else os.path.join(bench_dir, 'bench_' + (report['environment']['commit'] or 'nogit') + '.json')
+    os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+    with open(out_path, 'w') as file:
+        json.dump(report, file, indent=1)
+    print('results in ' + out_path)
+
+    if old_path:
+        sys.exit(1 if compare(load(old_path), report, threshold) else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+import numpy as np
+
+#
+# Preallocated numpy buffers for the time series of the plots.
+# A growable_buffer keeps every value of a run in one contiguous array that doubles when it is full, so appending is
+# amortized O(1) and the filled part is handed out as a view, never rebuilt from a deque. Sum, min and max are updated
+# on every append, averages and axis limits are O(1) no matter how long the run gets.
+# A ring_buffer keeps the last maxlen values in a fixed array, a typed replacement for collections.deque(maxlen=...):
+# 8 bytes per int64 sample (16 for a pair_dtype sample) instead of a boxed python object per value, and the window is
+# handed out as one or two zero-copy segments instead of being converted with np.asarray on every refresh.
+#
+
+pair_dtype = np.dtype([('x', np.int64), ('y', np.int64)])                # (x, y) samples, e.g. (host time, device time)
+
+class growable_buffer:
+
+    def __init__(self, dtype, capacity=1024):
+        self.data  = np.empty(capacity, dtype=dtype)
+        self.steps = None                                               # 1..capacity, x values of the per-packet plots, built by the first counts()
+        self.n     = 0
+        self.total = 0                                                  # running sum, a python int for integer buffers so it stays exact
+        self.min   = None
+        self.max   = None
+
+    def __len__(self):
+        return self.n
+
+    def append(self, value):
+        if self.n == len(self.data):
+            self._grow()
+        self.data[self.n] = value
+        self.n     += 1
+        self.total += value
+        if self.min is None or value < self.min: self.min = value
+        if self.max is None or value > self.max: self.max = value
+
+    def values(self):                                                   # view of the filled part, valid until the next append
+        return self.data[:self.n]
+
+    def counts(self):                                                   # 1..n as a view, np.arange only again once the buffer has grown
+        if self.steps is None or len(self.steps) < self.n:
+            self.steps = np.arange(1, len(self.data)+1, dtype=np.int64)
+        return self.steps[:self.n]
+
+    def mean(self):
+        return self.total / self.n if self.n else 0.0
+
+    def _grow(self):
+        data = np.empty(2 * len(self.data), dtype=self.data.dtype)
+        data[:self.n] = self.data[:self.n]
+        self.data  = data
+
+class ring_buffer:
+
+    def __init__(self, maxlen, dtype=np.int64):
+        self.maxlen = maxlen
+        self.data   = np.zeros(maxlen, dtype=dtype)
+        self.end    = 0                                                 # values appended so far, the next one goes to end % maxlen
+        self.n      = 0
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, index):                                       # 0 is the oldest value, -1 the newest
+        if index < 0:
+            index += self.n
+        if not 0 <= index < self.n:
+            raise IndexError('ring_buffer index out of range')
+        return self.data[(self.end - self.n + index) % self.maxlen]
+
+    def __iter__(self):
+        return iter(self.values())
+
+    def append(self, value):                                            # overwrites the oldest value once the buffer is full
+        self.data[self.end % self.maxlen] = value
+        self.end += 1
+        if self.n < self.maxlen:
+            self.n += 1
+
+    def segments(self):                                                 # (older, newer) zero-copy views, newer stays empty until the buffer wraps
+        start = (self.end - self.n) % self.maxlen
+        if start + self.n <= self.maxlen:
+            return self.data[start:start+self.n], self.data[:0]
+        return self.data[start:], self.data[:self.end % self.maxlen]
+
+    def values(self):                                                   # window oldest first, a view unless the buffer wrapped around
+        older, newer = self.segments()
+        return older if len(newer) == 0 else np.concatenate((older, newer))
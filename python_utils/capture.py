@@ -0,0 +1,71 @@
+import os
+
+#
+# Raw captures of the serial traffic, recorded live and replayed offline through the same parsers and plots.
+# A capture is an append-only utf-8 text file, one record per received line:
+#   <port name> \t <host receive time [ns], time.monotonic_ns()> \t <line as it came out of the reader>
+# The first line is a '# capture <tool> <format version>' header, further '#' lines are comments.
+# Appending to an existing capture keeps the old header, so one file can hold several recording sessions.
+#
+
+capture_magic   = '# capture'
+capture_version = 1
+write_buffer    = 1 << 20                                               # bytes buffered before hitting the disk
+
+class capture_writer:
+
+    def __init__(self, path, tool):
+        new_file   = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.path  = path
+        self.file  = open(path, 'a', encoding='utf-8', newline='\n', buffering=write_buffer)
+        self.count = 0                                                  # records written in this session
+        if new_file:
+            self.file.write(capture_magic + ' ' + tool + ' ' + str(capture_version) + '\n')
+
+    def write(self, port, host_time, line):
+        self.file.write(port + '\t' + str(host_time) + '\t' + line + '\n')
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+def capture_ports(path):                                                # port names in order of their first record, reads only the first column
+    ports = {}
+    with open(path, 'r', encoding='utf-8', buffering=write_buffer) as file:
+        for record in file:
+            if not record.startswith('#'):
+                ports.setdefault(record[:record.find('\t')], None)
+    return list(ports)
+
+class capture_reader:                                                   # drop-in for the reader queue, get() returns the next record
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'r', encoding='utf-8', buffering=write_buffer)
+        header    = self.file.readline().split()
+        if ' '.join(header[:2]) != capture_magic or len(header) < 4:
+            raise ValueError(path + ' is not a capture file')
+        self.tool    = header[2]                                        # script that recorded the capture
+        self.version = int(header[3])
+        if self.version > capture_version:
+            raise ValueError(path + ' has capture format ' + str(self.version) + ', newest supported is ' + str(capture_version))
+        self.count   = 0                                                # records handed out so far
+        self.records = iter(self)
+
+    def __iter__(self):
+        for record in self.file:
+            if record.startswith('#'):
+                continue
+            port, host_time, line = record.rstrip('\n').split('\t', 2)
+            self.count += 1
+            yield port, int(host_time), line
+
+    def get(self, timeout=None):                                        # same call and (port, host time, lines) batch as queue.Queue.get, EOFError once the capture is used up
+        try:
+            port, host_time, line = next(self.records)
+        except StopIteration:
+            raise EOFError(self.path)
+        return port, host_time, [line]
+
+    def close(self):
+        self.file.close()
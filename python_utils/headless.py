@@ -0,0 +1,42 @@
+import sys
+import json
+import time
+
+#
+# Periodic summaries of the live statistics for display-less runs (-headless of plot_sync_data and plot_coding_data).
+# The collectors keep parsing and computing exactly as with figures, instead of redrawing they hand a summary callback
+# to summary_emitter.poll(), which calls it at most once per interval and writes the result to stdout or a file,
+# either as one `key=value ...` line or as one json object per line (-json).
+#
+
+summary_interval = 1.0                                                  # default seconds between two summaries
+
+class summary_emitter:
+
+    def __init__(self, path='', as_json=False, interval=summary_interval):
+        self.file     = open(path, 'a') if path else sys.stdout
+        self.as_json  = as_json
+        self.interval = interval
+        self.start    = time.monotonic()
+        self.last     = self.start
+
+    def poll(self, summarize):                                          # summarize: () -> dict, only called when a summary is due
+        now = time.monotonic()
+        if now - self.last < self.interval:
+            return False
+        self.last = now
+        self.emit(summarize())
+        return True
+
+    def emit(self, summary):
+        summary = dict({'uptime': round(time.monotonic() - self.start, 3)}, **summary)
+        self.file.write((json.dumps(summary) if self.as_json else format_summary(summary)) + '\n')
+        self.file.flush()
+
+    def close(self, summary):                                           # final summary of the run
+        self.emit(summary)
+        if self.file is not sys.stdout:
+            self.file.close()
+
+def format_summary(summary):                                            # 'uptime=1.002 dt_mean=9.01 ...', floats with 2 decimals
+    return ' '.join(key + '=' + ('%.2f' % value if isinstance(value, float) else str(value)) for key, value in summary.items())
@@ -0,0 +1,181 @@
+#
+# Persistent-artist rendering for the live plots.
+# Lines, axhlines, bars and legends are created once and marked animated, a refresh only swaps their data
+# and blits them onto a cached background. The background (axes, ticks, labels, grid) is redrawn together
+# with tight_layout() only when the axis limits have to change or the window was resized.
+# Long lines are reduced to a min/max envelope per pixel column before they are handed to matplotlib,
+# which looks identical but keeps the rasterizing cost bound by the axes width instead of the window size.
+# render_scheduler decouples drawing from ingestion: parsers only mark figures dirty, the scheduler redraws
+# the dirty ones at a capped frame rate. Every poll renders at most one of them, round robin in registration order,
+# so the main loop gets back to the queue after each refresh instead of after all of them. Given a pipeline_metrics (metrics.py) it also records how long every refresh
+# took and how old the oldest data behind it was once it was on screen.
+# Nothing here imports matplotlib, the plot scripts get pyplot through pyplot() only once they create figures.
+#
+
+import time
+import numpy as np
+
+limit_headroom = 0.1                                                    # extra room added when limits grow, keeps relayouts rare
+limit_min_fill = 0.25                                                   # shrink limits once the data covers less than this share
+
+class blit_figure:
+
+    def __init__(self, fig):
+        self.fig        = fig
+        self.canvas     = fig.canvas
+        self.artists    = []                                            # animated artists, drawn in insertion order
+        self.background = None                                          # cached pixels of everything not animated
+        self.stale      = True                                          # background needs a full redraw
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+
+    def add(self, artist):
+        artist.set_animated(True)
+        self.artists.append(artist)
+        return artist
+
+    def add_all(self, artists):
+        for artist in artists:
+            self.add(artist)
+        return artists
+
+    def on_draw(self, event):                                           # every full draw (relayout, resize) renews the background
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.draw_artists()
+
+    def draw_artists(self):
+        for artist in self.artists:
+            self.fig.draw_artist(artist)
+
+    def set_line_data(self, line, x, y):                               # Line2D.set_data with decimation to the axes width
+        x, y = minmax_decimate(x, y, max(int(line.axes.bbox.width), 1))
+        line.set_data(x, y)
+
+    def fit_limits(self, ax, x_min, x_max, y_min, y_max):
+        self.fit_xlim(ax, x_min, x_max)
+        self.fit_ylim(ax, y_min, y_max)
+
+    def fit_xlim(self, ax, lo, hi):
+        limits = fit_range(ax.get_xlim(), lo, hi)
+        if limits is not None:
+            ax.set_xlim(limits)
+            self.stale = True
+
+    def fit_ylim(self, ax, lo, hi):
+        limits = fit_range(ax.get_ylim(), lo, hi)
+        if limits is not None:
+            ax.set_ylim(limits)
+            self.stale = True
+
+    def refresh(self):
+        if self.stale or self.background is None:
+            self.stale = False
+            self.fig.tight_layout()
+            self.canvas.draw()                                          # triggers on_draw, which draws the animated artists
+        else:
+            self.canvas.restore_region(self.background)
+            self.draw_artists()
+        self.canvas.blit(self.fig.bbox)
+        self.canvas.flush_events()
+
+    def savefig(self, path):                                           # animated artists are skipped by savefig, render them as normal ones
+        for artist in self.artists:
+            artist.set_animated(False)
+        self.fig.savefig(path)
+        for artist in self.artists:
+            artist.set_animated(True)
+
+def pyplot():                                                           # matplotlib.pyplot, imported on first use so headless runs never load it
+    import matplotlib.pyplot as plt
+    return plt
+
+def fit_range(current, lo, hi):                                        # new (lo, hi) limits or None if the current ones still fit
+    lo, hi = float(lo), float(hi)
+    if hi <= lo:
+        pad = max(abs(lo) * 0.05, 1.0)
+        lo, hi = lo - pad, hi + pad
+
+    cur_lo, cur_hi = current
+    fits_lo = cur_lo == lo if lo == 0 else cur_lo <= lo                 # ranges starting at zero (bars, densities) stay anchored
+    if fits_lo and hi <= cur_hi and (hi - lo) >= limit_min_fill * (cur_hi - cur_lo):
+        return None
+
+    pad = (hi - lo) * limit_headroom
+    return (lo if lo == 0 else lo - pad), hi + pad
+
+def minmax_decimate(x, y, buckets):                                    # keep min and max of every bucket, in their original order
+    x = np.asarray(x)
+    y = np.asarray(y)
+    index = minmax_indices(y, buckets)
+    return (x, y) if index is None else (x[index], y[index])
+
+def minmax_indices(y, buckets):                                        # indices minmax_decimate keeps, None if y is short enough already
+    if len(y) <= 2 * buckets:
+        return None
+
+    size  = -(-len(y) // buckets)                                      # samples per bucket, rounded up
+    cnt   = len(y) // size
+    rows  = y[:cnt * size].reshape(cnt, size)                          # a view for contiguous y, memory maps are only streamed through
+    start = np.arange(cnt) * size
+    i_min = start + rows.argmin(axis=1)
+    i_max = start + rows.argmax(axis=1)
+    index = np.stack([np.minimum(i_min, i_max), np.maximum(i_min, i_max)], axis=1).ravel()
+    if cnt * size < len(y):                                            # leftover samples of the last partial bucket
+        index = np.concatenate([index, np.arange(cnt * size, len(y))])
+    return index
+
+class render_scheduler:
+
+    def __init__(self, max_fps=30, metrics=None):
+        self.interval  = 1.0 / max_fps                                  # minimum time between the end of one frame and the next
+        self.renderers = {}                                             # name -> refresh callback, rendered in registration order
+        self.order     = []                                             # registered names, the round robin of poll()
+        self.next      = 0                                              # index into order where poll() looks for a dirty figure first
+        self.dirty     = set()                                          # names whose data changed since their last render
+        self.arrivals  = {}                                             # name -> monotonic_ns arrival of the oldest data not rendered yet
+        self.metrics   = metrics                                        # pipeline_metrics or None
+        self.last      = 0.0
+
+    def add(self, name, render):
+        self.renderers[name] = render
+        self.order.append(name)
+
+    def mark_dirty(self, *names, arrival=None):                         # arrival: monotonic_ns host time of the data behind the change
+        self.dirty.update(names)
+        if arrival is not None:
+            for name in names:
+                self.arrivals.setdefault(name, arrival)
+
+    def timeout(self, idle):                                            # how long the main loop may block on its queue, idle when nothing is dirty
+        if not self.dirty:
+            return idle
+        return max(0.0, self.interval - (time.monotonic() - self.last))
+
+    def poll(self):                                                     # cheap enough to call after every ingested batch, renders one dirty figure at most
+        if not self.dirty or time.monotonic() - self.last < self.interval:
+            return False
+        for i in range(len(self.order)):
+            name = self.order[(self.next + i) % len(self.order)]
+            if name in self.dirty:
+                self.next = (self.next + i + 1) % len(self.order)       # the other dirty figures go first next time
+                self.render(name)
+                self.last = time.monotonic()                            # measured after rendering, so slow frames leave ingestion its share
+                return True
+        self.dirty.clear()                                              # only names without a renderer, e.g. -headless
+        self.arrivals.clear()
+        return False
+
+    def flush(self):                                                    # render every dirty figure right away
+        for name in self.order:
+            if name in self.dirty:
+                self.render(name)
+        self.dirty.clear()
+        self.arrivals.clear()
+        self.last = time.monotonic()
+
+    def render(self, name):
+        start = time.perf_counter()
+        self.renderers[name]()
+        if self.metrics is not None:
+            self.metrics.rendered(name, time.perf_counter() - start, self.arrivals.get(name))
+        self.dirty.discard(name)
+        self.arrivals.pop(name, None)
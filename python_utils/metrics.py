@@ -0,0 +1,176 @@
+import json
+import time
+import bisect
+
+#
+# Live instrumentation of the collector pipeline: serial read -> parse -> statistics -> render.
+# Every port has a port_stats with the bytes and lines it delivered, the high-water mark of the driver's in_waiting
+# and the lines / bytes that were dropped because they could not be decoded. The main loop records how long the
+# parsing of every batch took and how deep the event queue got, the render_scheduler how long every refresh took and
+# how old the oldest data behind it was once its pixels were blitted (arrival-to-pixel latency, from the monotonic_ns
+# stamp the readers take). Exceptions the main loops swallow are counted by type.
+# Latencies go into fixed log-scale histograms (10 buckets per decade, 1 us .. 10 s), adding a sample is one bisect.
+# Once per metrics_interval poll() turns the totals into rates, appends them as one json line to the metrics log and
+# refreshes the status overlay. read_port.py children report their port_stats as a METRICS line on stderr instead.
+#
+
+metrics_interval = 1.0                                                  # seconds between two log records / overlay updates
+latency_edges    = [10 ** (i / 10) for i in range(71)]                  # upper bucket edges [us]
+metrics_prefix   = 'METRICS '                                           # stderr lines of read_port.py carrying port_stats
+port_counters    = ['bytes', 'lines', 'in_waiting_max', 'decode_failures', 'skipped_bytes']
+
+class latency_histogram:
+
+    def __init__(self):
+        self.counts = [0] * (len(latency_edges) + 1)                    # last bucket: everything above 10 s
+        self.count  = 0
+        self.total  = 0.0                                               # [us]
+        self.max    = 0.0
+
+    def add(self, seconds):
+        us = seconds * 1e6
+        self.counts[bisect.bisect_left(latency_edges, us)] += 1
+        self.count += 1
+        self.total += us
+        if us > self.max:
+            self.max = us
+
+    def percentile(self, q):                                            # upper edge of the bucket holding the q-th percentile [us]
+        rank = q / 100 * self.count
+        seen = 0
+        for i, cnt in enumerate(self.counts):
+            seen += cnt
+            if cnt and seen >= rank:
+                return min(latency_edges[i], self.max) if i < len(latency_edges) else self.max
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return {'count': 0}
+        return {'count': self.count, 'mean_us': round(self.total / self.count, 1), 'p50_us': round(self.percentile(50), 1),
+                'p90_us': round(self.percentile(90), 1), 'p99_us': round(self.percentile(99), 1), 'max_us': round(self.max, 1)}
+
+class port_stats:                                                       # written by one reader thread, read by the main loop
+
+    def __init__(self, name):
+        self.name            = name
+        self.bytes           = 0
+        self.lines           = 0                                        # lines or binary frames queued
+        self.in_waiting_max  = 0                                        # high-water mark of the driver input buffer [bytes]
+        self.decode_failures = 0                                        # lines dropped because they were no valid utf-8 or garbled
+        self.skipped_bytes   = 0                                        # binary ports: bytes dropped while resynchronising
+        self.previous        = (0, 0)                                   # (bytes, lines) at the previous poll
+
+    def read(self, size, in_waiting):
+        self.bytes += size
+        if in_waiting > self.in_waiting_max:
+            self.in_waiting_max = in_waiting
+
+    def counters(self):
+        return {name: getattr(self, name) for name in port_counters}
+
+def format_metrics_line(stats):                                         # 'METRICS bytes=... lines=... ...', read_port.py -> stderr
+    return metrics_prefix + ' '.join(name + '=' + str(value) for name, value in stats.counters().items())
+
+def parse_metrics_line(line):                                           # counters of a METRICS line, None for any other line
+    if not line.startswith(metrics_prefix):
+        return None
+    try:
+        return {name: int(value) for name, value in (item.split('=') for item in line[len(metrics_prefix):].split())}
+    except ValueError:
+        return None
+
+class pipeline_metrics:
+
+    def __init__(self, log_path=''):
+        self.ports        = {}                                          # port name -> port_stats
+        self.parse_time   = latency_histogram()                         # per batch taken off the event queue
+        self.refresh_time = {}                                          # figure name -> latency_histogram
+        self.latency      = latency_histogram()                         # arrival-to-pixel
+        self.errors       = {}                                          # exception type -> count
+        self.queue_max    = 0                                           # high-water mark of the event queue [batches]
+        self.start        = time.monotonic()
+        self.last         = self.start
+        self.log          = open(log_path, 'a') if log_path else None
+        self.status       = ''
+        self.overlay      = None                                        # text artist of the status overlay
+
+    def port(self, name):
+        if name not in self.ports:
+            self.ports[name] = port_stats(name)
+        return self.ports[name]
+
+    def update_port(self, name, counters):                              # totals reported by a read_port.py child
+        stats = self.port(name)
+        for counter, value in counters.items():
+            if counter in port_counters:
+                setattr(stats, counter, value)
+
+    def count_error(self, ex):
+        kind = type(ex).__name__
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def parsed(self, seconds, queue_size):
+        self.parse_time.add(seconds)
+        if queue_size > self.queue_max:
+            self.queue_max = queue_size
+
+    def rendered(self, name, seconds, arrival):                         # arrival: monotonic_ns of the oldest data behind the refresh, or None
+        if name not in self.refresh_time:
+            self.refresh_time[name] = latency_histogram()
+        self.refresh_time[name].add(seconds)
+        if arrival is not None:
+            self.latency.add((time.monotonic_ns() - arrival) / 1e9)
+
+    def attach(self, view):                                             # status overlay in the lower left corner of a blit_figure
+        self.overlay = view.add(view.fig.text(0.005, 0.005, '', fontsize=7, family='monospace', va='bottom', alpha=0.8))
+
+    def poll(self):                                                     # True when the overlay text changed and its figure needs a refresh
+        now = time.monotonic()
+        if now - self.last < metrics_interval:
+            return False
+        record = self.snapshot(now)
+        if self.log is not None:
+            self.log.write(json.dumps(record) + '\n')
+            self.log.flush()
+        self.status = status_text(record)
+        if self.overlay is None:
+            return False
+        self.overlay.set_text(self.status)
+        return True
+
+    def snapshot(self, now):                                            # rates since the previous snapshot, everything else since the start
+        elapsed = max(now - self.last, 1e-9)
+        ports   = {}
+        for name, stats in list(self.ports.items()):
+            counters = stats.counters()
+            counters['bytes_per_s'] = round((stats.bytes - stats.previous[0]) / elapsed, 1)
+            counters['lines_per_s'] = round((stats.lines - stats.previous[1]) / elapsed, 1)
+            stats.previous = (stats.bytes, stats.lines)
+            ports[name] = counters
+        self.last = now
+        return {'time': time.time(), 'uptime': round(now - self.start, 3), 'ports': ports, 'queue_max': self.queue_max,
+                'parse': self.parse_time.summary(), 'refresh': {name: hist.summary() for name, hist in self.refresh_time.items()},
+                'latency': self.latency.summary(), 'errors': dict(self.errors)}
+
+    def close(self):                                                    # last record, returns the final status text
+        record = self.snapshot(time.monotonic())
+        if self.log is not None:
+            self.log.write(json.dumps(record) + '\n')
+            self.log.close()
+        return status_text(record)
+
+def status_text(record):
+    lines = []
+    for name, port in record['ports'].items():
+        lines.append('%-8s %8.1f kB/s %7.0f lines/s  in_waiting max %6d B  decode failures %d  skipped %d B'
+                     % (name, port['bytes_per_s'] / 1e3, port['lines_per_s'], port['in_waiting_max'], port['decode_failures'], port['skipped_bytes']))
+    refresh = max(record['refresh'].values(), key=lambda hist: hist.get('p99_us', 0), default={'count': 0})
+    lines.append('queue max %d  parse p99 %s  refresh p99 %s  arrival-to-pixel p50 %s p99 %s  errors %s'
+                 % (record['queue_max'], format_us(record['parse'], 'p99_us'), format_us(refresh, 'p99_us'),
+                    format_us(record['latency'], 'p50_us'), format_us(record['latency'], 'p99_us'),
+                    ', '.join(kind + ' ' + str(cnt) for kind, cnt in record['errors'].items()) or '0'))
+    return '\n'.join(lines)
+
+def format_us(summary, key):
+    return '%.2f ms' % (summary[key] / 1e3) if summary.get('count') else '-'
@@ -0,0 +1,104 @@
+import numpy as np
+
+#
+# Observer edge events, either as text lines or as binary frames (CONFIG_OBSERVER_BINARY_FRAMES in main/main.c).
+# Binary frame layout, little endian, 14 bytes:
+#   0xA5 0x5A | gpio u8 | edge u8 (0 rising, 1 falling) | timestamp i64 [us] | crc u16 (CRC-16/CCITT-FALSE over gpio..timestamp)
+# Whole byte buffers are decoded at once into a structured array, the CRC of all frames is checked in one vectorized pass.
+#
+
+edge_rising  = 0
+edge_falling = 1
+
+frame_sync  = b'\xa5\x5a'
+frame_dtype = np.dtype([('sync', '<u2'), ('gpio', 'u1'), ('edge', 'u1'), ('timestamp', '<i8'), ('crc', '<u2')])
+frame_size  = frame_dtype.itemsize
+crc_start   = frame_dtype.fields['gpio'][1]                            # byte range covered by the crc
+crc_stop    = frame_dtype.fields['crc'][1]
+
+def make_crc_table():
+    table = np.zeros(256, dtype=np.uint16)
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        table[byte] = crc & 0xFFFF
+    return table
+
+crc_table = make_crc_table()
+
+def crc16_ccitt(rows):                                                 # rows: (n, k) uint8 array -> crc of every row, (n,) uint16
+    crc = np.full(len(rows), 0xFFFF, dtype=np.uint16)
+    for column in rows.T:                                              # k steps, each one vectorized over all frames
+        crc = (crc << np.uint16(8)) ^ crc_table[(crc >> np.uint16(8)) ^ column]
+    return crc
+
+def encode_frames(gpio, edge, timestamp):                              # inverse of decode_frames, used by tests and emulators
+    frames = np.zeros(len(timestamp), dtype=frame_dtype)
+    frames['sync']      = int.from_bytes(frame_sync, 'little')
+    frames['gpio']      = gpio
+    frames['edge']      = edge
+    frames['timestamp'] = timestamp
+    rows = frames.view(np.uint8).reshape(len(frames), frame_size)
+    frames['crc'] = crc16_ccitt(rows[:, crc_start:crc_stop])
+    return frames.tobytes()
+
+def decode_frames(buffer):
+    # returns (frames, consumed, skipped): the decoded structured array, how many bytes of buffer were used up
+    # and how many of them were dropped while resynchronising on corrupted data or text output of the boot loader
+    raw_bytes = bytes(buffer)
+    data      = np.frombuffer(raw_bytes, dtype=np.uint8)
+    chunks    = []
+    pos       = 0
+    skipped   = 0
+
+    while len(data) - pos >= frame_size:
+        cnt   = (len(data) - pos) // frame_size
+        rows  = data[pos:pos + cnt*frame_size].reshape(cnt, frame_size)
+        crc   = rows[:, crc_stop].astype(np.uint16) | (rows[:, crc_stop+1].astype(np.uint16) << np.uint16(8))
+        valid = (rows[:, 0] == frame_sync[0]) & (rows[:, 1] == frame_sync[1]) & (crc16_ccitt(rows[:, crc_start:crc_stop]) == crc)
+
+        good = cnt if valid.all() else int(np.argmin(valid))           # frames up to the first broken one
+        if good:
+            chunks.append(rows[:good].copy().view(frame_dtype)[:, 0])
+        pos += good * frame_size
+        if good == cnt:
+            break
+
+        resync = raw_bytes.find(frame_sync, pos + 1)                   # next frame candidate after the broken one
+        if resync < 0:
+            resync = len(raw_bytes) - 1 if raw_bytes[-1] == frame_sync[0] else len(raw_bytes)
+        skipped += resync - pos
+        pos = resync
+
+    frames = np.concatenate(chunks) if chunks else np.empty(0, dtype=frame_dtype)
+    return frames, pos, skipped
+
+def parse_edge_line(line):                                             # text mode: 'GPIO18 EDGE RISING  12345' -> (18, edge_rising, 12345), None for other or garbled lines
+    if 'RISING' in line:
+        edge = edge_rising
+    elif 'FALLING' in line:
+        edge = edge_falling
+    else:
+        return None
+    parts = line.split()
+    try:
+        return int(parts[0][4:]), edge, int(parts[-1])
+    except ValueError:                                                  # e.g. the partial first line after reset_input_buffer()
+        return None
+
+def format_edge_line(gpio, edge, timestamp):                           # same text the observer prints without binary frames
+    return 'GPIO' + str(gpio) + (' EDGE RISING  ' if edge == edge_rising else ' EDGE FALLING ') + str(timestamp)
+
+def edge_lines(payload):                                               # text lines of a batch of text lines or a decoded frame array, used for captures
+    if isinstance(payload, list):
+        return payload
+    return [format_edge_line(*event) for event in edge_events(payload)]
+
+def edge_events(payload, stats=None):                                  # (gpio, edge, timestamp) tuples of a batch of text lines or a decoded frame array
+    if isinstance(payload, list):
+        events = [event for event in map(parse_edge_line, payload) if event]
+        if stats is not None and len(events) < len(payload):            # garbled edge lines count as decode failures of the port
+            stats.decode_failures += sum(' EDGE ' in line for line in payload) - len(events)
+        return events
+    return zip(payload['gpio'].tolist(), payload['edge'].tolist(), payload['timestamp'].tolist())
@@ -0,0 +1,91 @@
+import asyncio
+import threading
+import queue
+import time
+from subprocess import PIPE
+from serial_reader import split_lines
+from metrics import parse_metrics_line
+
+#
+# Multiplexed reading of child process pipes, used by plot_coding_data -subprocess for the read_port.py children.
+# One asyncio event loop in a background thread services stdout and stderr of every child at the same time and feeds
+# the same (port name, host time, lines) queue as the in-process serial readers, so a quiet stderr or a silent board
+# never stalls the others. Works with the proactor loop on Windows as well as with the selector loop on Linux.
+# METRICS lines on the stderr of a child carry its port counters and go to the pipeline_metrics instead of the console.
+#
+
+pipe_chunk = 1 << 16                                                    # max bytes taken off a pipe per read
+
+class pipe_multiplexer(threading.Thread):
+
+    def __init__(self, commands, events, metrics=None):
+        super().__init__(name='pipe-multiplexer', daemon=True)
+        self.commands   = commands                                      # port name -> argv of the child process
+        self.events     = events                                        # shared queue.Queue of (port_name, host_time [ns], lines)
+        self.metrics    = metrics                                       # pipeline_metrics fed by the METRICS lines, or None
+        self.processes  = {}                                            # port name -> asyncio.subprocess.Process
+        self.loop       = None
+        self.started    = threading.Event()                             # set once every child is running
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.loop.run_until_complete(self.serve())
+        finally:
+            self.started.set()                                          # never leave start_process_readers waiting
+            self.loop.close()
+
+    async def serve(self):
+        for name, argv in self.commands.items():
+            self.processes[name] = await asyncio.create_subprocess_exec(*argv, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        self.started.set()
+
+        pumps = []
+        for name, process in self.processes.items():
+            pumps.append(self.pump(name, process.stdout, False))
+            pumps.append(self.pump(name, process.stderr, True))
+        await asyncio.gather(*pumps)                                    # returns once every child closed its pipes
+
+    async def pump(self, name, stream, is_error):
+        pending = bytearray()                                           # partial line left over from the previous read
+        while True:
+            chunk = await stream.read(pipe_chunk)                       # whatever the child has written so far, read_port.py writes whole batches
+            if not chunk:
+                break
+            host_time = time.monotonic_ns()
+
+            pending += chunk
+            lines = split_lines(pending)
+            if not lines:
+                continue
+            if is_error:
+                for line in lines:
+                    counters = parse_metrics_line(line)
+                    if counters is None:
+                        print('ERROR ' + name + ': ' + line)
+                    elif self.metrics is not None:
+                        self.metrics.update_port(name, counters)
+            else:
+                self.events.put((name, host_time, lines))
+
+    def terminate(self):                                                # runs inside the event loop
+        for process in self.processes.values():
+            if process.returncode is None:
+                try:
+                    process.terminate()
+                except ProcessLookupError:
+                    pass
+
+    def stop(self):
+        try:
+            self.loop.call_soon_threadsafe(self.terminate)
+        except RuntimeError:                                            # loop already finished on its own
+            pass
+        self.join(timeout=1)
+
+def start_process_readers(commands, metrics=None):
+    events      = queue.Queue()
+    multiplexer = pipe_multiplexer(commands, events, metrics)
+    multiplexer.start()
+    multiplexer.started.wait()
+    return events, multiplexer
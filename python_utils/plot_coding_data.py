@@ -1,81 +1,66 @@
 import sys
-import matplotlib.pyplot as plt
 import numpy as np
-import collections
-import os
-from subprocess import Popen, PIPE
+import time
+import queue
+from serial_reader import configure_serial, start_readers, stop_readers
+from pipe_reader import start_process_readers
+from live_plot import blit_figure, render_scheduler, pyplot
+from relay_store import relay_store
+from seqnum_tracker import seqnum_tracker
+from buffers import growable_buffer, ring_buffer
+from capture import capture_writer
+from metrics import pipeline_metrics
+from headless import summary_emitter, summary_interval
 
 #
 # Run:
 # `python ../python_utils/plot_coding_data.py -p COM1 COM2 COM3 ...            # -n followed by a list of the ports connected to the esp devboard
+# optional: -fps N caps the redraw rate of the figures (default 30)
+#           -record FILE appends every received line to a capture file, ports are stored as relay, native1, native2, ...
+#           -subprocess reads every port in its own read_port.py process instead of a reader thread
+#           -metrics FILE appends the pipeline metrics (see metrics.py) once per second as json lines
+#           -status shows the pipeline metrics as an overlay on the coding gain figure
+#           -headless no figures and no matplotlib import, a summary of the statistics (coding_summary) is written every
+#           second instead, -every S changes the interval, -json writes json lines, -summary FILE appends them to FILE
+#           instead of stdout (keeps them apart from the console messages)
 #
 
 dequeue_len = 1000
 baudrate    = 921600
 
-relay_file = '.\\export\\coding_plot\\temp.txt'
-
 class native_node:
     
     def __init__(self, port):
         self.port            = port
-        self.process         = Popen(['python', 'read_port.py', port, str(baudrate)], stdin=PIPE, stdout=PIPE, stderr=PIPE)        
-        self.send_natPckt    = collections.deque(maxlen=dequeue_len)       # sequence numbers of transmitted native packets
-        self.recv_natPckt    = collections.deque(maxlen=dequeue_len)       # sequecne numbers of sucessfully decoded packets 
+        self.send_natPckt    = ring_buffer(dequeue_len)                    # sequence numbers of transmitted native packets
+        self.recv_natPckt    = ring_buffer(dequeue_len)                    # sequecne numbers of sucessfully decoded packets 
         self.encRcvCnt       = 0                                           # number of total received broadcasts
         self.decInstCnt      = 0                                           # number of instantly decoded packets
         self.decCashCnt      = 0                                           # number of decoded packets from cash
         self.decRedunCnt     = 0                                           # number of redundant decodings
         self.PcktCntInCash   = 0                                           # 
-        self.PcktsMissing    = collections.deque(maxlen=dequeue_len)
+        self.PcktsMissing    = ring_buffer(dequeue_len)
         self.shutdown        = 0                                           # flag indicating if peer has shutdown
     
-    def parse_values(self):
-        try:
-            
-            line = self.process.stdout.readline().decode().strip()
-            if line:
-                #print(self.port + ': ' + line)
-                return update_relay(self, line)
-            
-            error = self.process.stderr.readline().decode().strip()
-            if error:    
-                print('ERROR ' + self.port + ': ' + error)
-        
-        except Exception as e:
-            return False
-
 class relay_node:
     
     def __init__(self, port):
         self.port               = port
-        self.process            = Popen(['python', 'read_port.py', port, str(baudrate)], stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        self.enc_natPckt        = collections.deque(maxlen=dequeue_len)     # sequence numbers of received native packets
-        self.EncTransPerNat     = collections.deque(maxlen=dequeue_len)     # list with number of encoded broadcasts per natural packet
-        self.recv_natPckt       = collections.deque(maxlen=dequeue_len)
+        self.enc_natPckt        = seqnum_tracker(dequeue_len)               # sequence numbers of received native packets
+        self.EncTransPerNat     = growable_buffer(np.int64)                 # number of encoded broadcasts per natural packet
+        self.recv_natPckt       = ring_buffer(dequeue_len)
         self.encCnt             = 0                                         # number of encoded packets
-        self.encCntPerBrd       = collections.deque(maxlen=dequeue_len)
+        self.encNatCnt          = 0                                         # number of distinct native packets encoded so far
+        self.CodGain            = growable_buffer(np.float64)               # encNatCnt / encCnt after every encoded broadcast
         self.retransCnt         = 0                                         # retransmission counter
-        self.EncMissing         = collections.deque(maxlen=dequeue_len)
-        self.BloomSize          = collections.deque(maxlen=dequeue_len)
-        self.CumulSize          = collections.deque(maxlen=dequeue_len)
+        self.EncMissing         = seqnum_tracker(dequeue_len)               # received native packets not encoded yet
+        self.BloomSize          = growable_buffer(np.int64)
+        self.CumulSize          = growable_buffer(np.int64)
         self.ReportSavings      = 0
         self.shutdown           = 0                                         # flag indicating if peer has shutdown
 
-    def parse_values(self):
-        try:
-            
-            line = self.process.stdout.readline().decode().strip()
-            if line:
-                #print(self.port + ': ' + line)
-                return update_relay(self, line)
-            
-            error = self.process.stderr.readline().decode().strip()
-            if error:    
-                print('ERROR ' + self.port + ': ' + error)
-        
-        except Exception as e:
-            return False
+def ideal_coding_gain(native_cnt):
+    return native_cnt/(native_cnt-1) if native_cnt > 1 else 1.0      # a single native node leaves nothing to encode
 
 def update_relay(self, line):
     if not isinstance(self, relay_node):
@@ -96,18 +81,17 @@ def update_relay(self, line):
         seqnum2 = abs(int(parts[parts.index('[')+2]))
         if seqnum1 not in self.enc_natPckt:
             self.enc_natPckt.append(seqnum1)
+            self.encNatCnt += 1
             self.EncTransPerNat.append(self.encCnt)
         if seqnum2 not in self.enc_natPckt:
             self.enc_natPckt.append(seqnum2)
+            self.encNatCnt += 1
             self.EncTransPerNat.append(self.encCnt)
 
-        self.encCntPerBrd.append(len(self.enc_natPckt))
+        self.CodGain.append(self.encNatCnt / self.encCnt)
 
-        if seqnum1 in self.EncMissing:
-            self.EncMissing.remove(seqnum1)
-        
-        if seqnum2 in self.EncMissing:
-            self.EncMissing.remove(seqnum2)
+        self.EncMissing.discard(seqnum1)
+        self.EncMissing.discard(seqnum2)
 
         return True
 
@@ -174,61 +158,81 @@ def update_native(self, line):
 
     return False
 
-def update_relay_coding_plot(fig_relay_coding_gain, RelTransAx, RelCodGainvAx, relay, native_cnt):
-    RelTransAx.clear()
-    RelCodGainvAx.clear()
-
-    x_trans = np.arange(1, len(relay.EncTransPerNat)+1, 1, dtype=np.int64)
-    y_trans = np.asarray(relay.EncTransPerNat, dtype=np.int64)
-
-    x_cod_gain = np.arange(1, len(relay.encCntPerBrd)+1, 1, dtype=np.int64)
-    y_cod_gain = np.asarray(relay.encCntPerBrd, dtype=np.float32) / np.arange(1, len(relay.encCntPerBrd)+1, 1, dtype=np.int64)
-
-    cod_gain_avg = 0 if len(y_cod_gain)== 0 else sum(y_cod_gain) / len(y_cod_gain)
-    cod_gain_ideal = native_cnt/(native_cnt-1)
+def init_relay_coding_plot(fig_relay_coding_gain, RelTransAx, RelCodGainvAx, native_cnt):
+    view = blit_figure(fig_relay_coding_gain)
+    cod_gain_ideal = ideal_coding_gain(native_cnt)
 
     RelTransAx.set_title('transmissions at the relay node with ' + str(native_cnt) + ' native nodes')
-    RelTransAx.plot(x_trans, y_trans, 'b-', label='measured')
-    RelTransAx.plot(x_trans, x_trans/cod_gain_ideal, 'g--', label='ideal')
-    RelTransAx.plot(x_trans, x_trans, 'r--', label='no encoding')
+    view.trans_line   = view.add(RelTransAx.plot([], [], 'b-', label='measured')[0])
+    view.ideal_line   = view.add(RelTransAx.plot([], [], 'g--', label='ideal')[0])
+    view.nocode_line  = view.add(RelTransAx.plot([], [], 'r--', label='no encoding')[0])
     RelTransAx.set_ylabel('broadcast transmissions')
     RelTransAx.set_xlabel('number of encoded native packets')
-    RelTransAx.legend(loc='lower right')
+    view.add(RelTransAx.legend(loc='lower right'))
     RelTransAx.grid(True)
     
     RelCodGainvAx.set_title('course of coding gain at relay node with ' + str(native_cnt) + ' native nodes')
-    RelCodGainvAx.plot(x_cod_gain, y_cod_gain, 'b-', label='measured')
-    #RelCodGainvAx.axhline(cod_gain_avg, color='r', linestyle='--', label=f'average = {round(cod_gain_avg, 2)}')
-    RelCodGainvAx.axhline(cod_gain_ideal, color='g', linestyle='--', label=f'ideal = {round(cod_gain_ideal, 2)}')
+    view.cod_gain_line = view.add(RelCodGainvAx.plot([], [], 'b-', label='measured')[0])
+    #view.cod_gain_avg_line = view.add(RelCodGainvAx.axhline(0, color='r', linestyle='--', label='average'))
+    view.add(RelCodGainvAx.axhline(cod_gain_ideal, color='g', linestyle='--', label=f'ideal = {round(cod_gain_ideal, 2)}'))
     RelCodGainvAx.set_ylabel('coding gain')
     RelCodGainvAx.set_xlabel('encoded native packets')
-    RelCodGainvAx.legend(loc='upper right')
+    view.add(RelCodGainvAx.legend(loc='upper right'))
     RelCodGainvAx.grid(True)
 
-    fig_relay_coding_gain.tight_layout()
-    fig_relay_coding_gain.canvas.flush_events()
+    return view
+
+def update_relay_coding_plot(view, relay, native_cnt):
+    x_trans = relay.EncTransPerNat.counts()
+    y_trans = relay.EncTransPerNat.values()
+
+    x_cod_gain = relay.CodGain.counts()
+    y_cod_gain = relay.CodGain.values()
+
+    cod_gain_ideal = ideal_coding_gain(native_cnt)
 
-def update_relay_report_plot(fig_relay_recep_rep , RecepTransAx, relay, native_cnt):
-    RecepTransAx.clear()
+    view.set_line_data(view.trans_line, x_trans, y_trans)
+    view.ideal_line.set_data(x_trans, x_trans/cod_gain_ideal)
+    view.nocode_line.set_data(x_trans, x_trans)
+    if len(x_trans):
+        view.fit_limits(view.trans_line.axes, 1, len(x_trans), 0, max(relay.EncTransPerNat.max, len(x_trans)))
+
+    view.set_line_data(view.cod_gain_line, x_cod_gain, y_cod_gain)
+    if len(x_cod_gain):
+        view.fit_limits(view.cod_gain_line.axes, 1, len(x_cod_gain), min(relay.CodGain.min, cod_gain_ideal), max(relay.CodGain.max, cod_gain_ideal))
+
+    view.refresh()
+
+def init_relay_report_plot(fig_relay_recep_rep, RecepTransAx, native_cnt):
+    view = blit_figure(fig_relay_recep_rep)
     RecepTransAx.set_title('reception report savings over one cycle with ' + str(native_cnt) + ' native nodes')
 
     descr = ['average bloom filter\nreception report size', 'average cumulative\nreception report size', 'total savings\nover one cycle']
     bar_color = ['tab:blue', 'tab:red', 'tab:green']
 
-    avg_size_bloom = round( sum(relay.BloomSize) / len(relay.BloomSize), 2)
-    avg_size_cumul = round( sum(relay.CumulSize) / len(relay.CumulSize), 2)
-
-    data = (avg_size_bloom, avg_size_cumul, relay.ReportSavings)
-
-    rects = RecepTransAx.bar(descr, data, width=0.5, color=bar_color)
-    RecepTransAx.bar_label(rects)
+    rects = RecepTransAx.bar(descr, [0]*len(descr), width=0.5, color=bar_color)
+    view.bars   = view.add_all(rects.patches)
+    view.labels = view.add_all(RecepTransAx.bar_label(rects))
     #saving = relay.ReportData[1]-relay.ReportData[0]
 
     #RecepTransAx.bar(descr[0], saving, width=0.5, color='tab:orange', label='savings', bottom =relay.ReportData[0])
     RecepTransAx.set_ylabel('size [bytes]')
 
-    fig_relay_recep_rep.tight_layout()
-    fig_relay_recep_rep.canvas.flush_events()
+    return view
+
+def update_relay_report_plot(view, relay, native_cnt):
+    avg_size_bloom = round(relay.BloomSize.mean(), 2)                  # running sums, no pass over the samples
+    avg_size_cumul = round(relay.CumulSize.mean(), 2)
+
+    data = (avg_size_bloom, avg_size_cumul, relay.ReportSavings)
+
+    for bar, label, value in zip(view.bars, view.labels, data):
+        bar.set_height(value)
+        label.xy = (bar.get_x() + bar.get_width()/2, value)             # bar_label anchors at the top center of the bar
+        label.set_text(f'{value:g}')
+    view.fit_ylim(view.bars[0].axes, 0, max(data))
+
+    view.refresh()
 
 def update_native_bar_plot(fig_native_bar_plot, NatBarAx, native_nodes):
     NatBarAx.clear()
@@ -258,49 +262,44 @@ def update_native_bar_plot(fig_native_bar_plot, NatBarAx, native_nodes):
 
 def save_relay_values_to_file(relay, native_cnt):
 
-    transm = np.asarray(relay.EncTransPerNat, dtype=np.int64)
-    cod_gain      = np.asarray(relay.encCntPerBrd, dtype=np.float32) / np.arange(1, len(relay.encCntPerBrd)+1, 1, dtype=np.int64)
+    transm   = relay.EncTransPerNat.values()
+    cod_gain = relay.CodGain.values()
 
-    cod_gain_avg = 0 if len(cod_gain)== 0 else sum(cod_gain) / len(cod_gain)
-    cod_gain_ideal = native_cnt/(native_cnt-1)
-
-    write_values_to_file(relay_file, transm, cod_gain, cod_gain_avg, cod_gain_ideal, native_cnt)
-
-def write_values_to_file(filename, transm, cod_gain, cod_gain_avg, cod_gain_ideal, native_cnt):
-    if not os.path.exists(filename):
-        with open(filename, 'w') as file:
-            file.write("")
-
-    with open(filename, 'r') as file:
-        lines = file.readlines()
-
-    start_index = None
-    for i, line in enumerate(lines):
-        if f"Values for {native_cnt} native nodes:" in line:
-            start_index = i
-            break
+    cod_gain_avg = relay.CodGain.mean()
+    cod_gain_ideal = ideal_coding_gain(native_cnt)
 
-    if start_index is not None:
-        end_index = start_index
-        while end_index < len(lines) and "Values for " not in lines[end_index]:
-            end_index += 1
-        del lines[start_index:end_index]
+    key = relay_store().put(native_cnt, {'transm': transm, 'cod_gain': cod_gain}, {'cod_gain_avg': float(cod_gain_avg), 'cod_gain_ideal': cod_gain_ideal})
+    print('Stored relay values as ' + key)
 
-    with open(filename, 'w') as file:
-        file.writelines(lines)
-
-        file.write(f"Values for {native_cnt} native nodes:\n")
-
-        file.write("\ntransm: ")
-        np.savetxt(file, transm.reshape(1, -1), delimiter=',', fmt='%d')
-        file.write("\ncod_gain: ")
-        np.savetxt(file, cod_gain.reshape(1, -1), delimiter=',', fmt='%.6f')
-        file.write("\ncod_gain_avg: %.6f\n" % cod_gain_avg)
-        file.write("cod_gain_ideal: %.6f\n\n" % cod_gain_ideal)
+def coding_summary(relay, native_nodes):                                # scalar statistics of a coding run, used by batch_analyze
+    native_cnt = len(native_nodes)
+    return {'native_cnt': native_cnt, 'encoded': relay.encCnt, 'encoded_natives': relay.encNatCnt, 'retransmissions': relay.retransCnt,
+            'cod_gain_avg': float(relay.CodGain.mean()), 'cod_gain_final': float(relay.CodGain.values()[-1]) if len(relay.CodGain) else 0.0,
+            'cod_gain_ideal': ideal_coding_gain(native_cnt), 'bloom_size_avg': float(relay.BloomSize.mean()),
+            'cumul_size_avg': float(relay.CumulSize.mean()), 'report_savings': relay.ReportSavings,
+            'decoded': sum(node.decInstCnt + node.decCashCnt for node in native_nodes), 'redundant': sum(node.decRedunCnt for node in native_nodes)}
 
 def main():
 
     args = sys.argv
+    max_fps = float(args[args.index('-fps')+1]) if '-fps' in args else 30
+    if '-fps' in args: del args[args.index('-fps'):args.index('-fps')+2]   # -p consumes the rest of the arguments
+    record_path = args[args.index('-record')+1] if '-record' in args else ''
+    if '-record' in args: del args[args.index('-record'):args.index('-record')+2]
+    subprocess_mode = '-subprocess' in args
+    if subprocess_mode: args.remove('-subprocess')
+    metrics_path = args[args.index('-metrics')+1] if '-metrics' in args else ''
+    if '-metrics' in args: del args[args.index('-metrics'):args.index('-metrics')+2]
+    show_status = '-status' in args
+    if show_status: args.remove('-status')
+    summary_path = args[args.index('-summary')+1] if '-summary' in args else ''
+    if '-summary' in args: del args[args.index('-summary'):args.index('-summary')+2]
+    summary_every = float(args[args.index('-every')+1]) if '-every' in args else summary_interval
+    if '-every' in args: del args[args.index('-every'):args.index('-every')+2]
+    headless = '-headless' in args
+    if headless: args.remove('-headless')
+    summary_json = '-json' in args
+    if summary_json: args.remove('-json')
     ports   = args[args.index('-p')+1 :]  if '-p' in args else ''
 
     node_cnt = len(ports)
@@ -312,28 +311,81 @@ def main():
         if port != ports[0]:  # exclude the port used by the relay node
             native = native_node(port)
             native_nodes.append(native)
+    nodes = {node.port: node for node in [relay] + native_nodes}
+
+    metrics = pipeline_metrics(metrics_path)
+    start_time = time.perf_counter()
+    if subprocess_mode:
+        events, multiplexer = start_process_readers({port: ['python', 'read_port.py', port, str(baudrate)] for port in nodes}, metrics)
+    else:
+        events, readers = start_readers({port: configure_serial(port, baudrate) for port in nodes}, {}, metrics)
+    print('started %d port readers in %.1f ms' % (len(nodes), (time.perf_counter() - start_time)*1e3))
+    recorder      = capture_writer(record_path, 'plot_coding_data') if record_path else None
+    capture_names = {relay.port: 'relay'}                               # the relay is told apart by name when the capture is analyzed again
+    capture_names.update({native.port: 'native' + str(i+1) for i, native in enumerate(native_nodes)})
 
     print('\nPress the reset button on one of the ESP32 boards...')
 
-    # plots
-    plt.ion()
-    fig_relay_coding_gain , (RelTransAx, RelCodGainvAx) = plt.subplots(2, 1, figsize=(10, 6), sharex=False)
-    fig_relay_recep_rep , RecepTransAx = plt.subplots(figsize=(10, 6))
-    fig_native_coding_gain, NatBarAx  = plt.subplots(figsize=(10, 6))
+    # parsing only marks figures dirty, the scheduler redraws them at most max_fps times per second
+    scheduler = render_scheduler(max_fps, metrics)
+    summarize = lambda: coding_summary(relay, native_nodes)
+
+    if headless:                                                        # same parsing and statistics, no figures and no matplotlib
+        emitter = summary_emitter(summary_path, summary_json, summary_every)
+    else:
+        # plots
+        plt = pyplot()
+        plt.ion()
+        fig_relay_coding_gain , (RelTransAx, RelCodGainvAx) = plt.subplots(2, 1, figsize=(10, 6), sharex=False)
+        fig_relay_recep_rep , RecepTransAx = plt.subplots(figsize=(10, 6))
+        fig_native_coding_gain, NatBarAx  = plt.subplots(figsize=(10, 6))
+
+        relay_coding_view = init_relay_coding_plot(fig_relay_coding_gain, RelTransAx, RelCodGainvAx, len(native_nodes))
+        relay_report_view = init_relay_report_plot(fig_relay_recep_rep, RecepTransAx, len(native_nodes))
+
+        if show_status:
+            metrics.attach(relay_coding_view)
+
+        scheduler.add('coding', lambda: update_relay_coding_plot(relay_coding_view, relay, len(native_nodes)))
+        scheduler.add('report', lambda: update_relay_report_plot(relay_report_view, relay, len(native_nodes)))
 
     start = False       
     last = 0
+    line_cnt = 0
 
     while True:
         try:
-            if relay.parse_values():
-                update_relay_coding_plot(fig_relay_coding_gain, RelTransAx, RelCodGainvAx, relay, len(native_nodes))
+            try:
+                port, host_time, lines = events.get(timeout=scheduler.timeout(0.1))     # batches of lines of every board, in arrival order
+            except queue.Empty:
+                if metrics.poll(): scheduler.mark_dirty('coding')
+                if headless: emitter.poll(summarize)
+                scheduler.poll()
+                continue
+            parse_start = time.perf_counter()
+
+            line_cnt += len(lines)
+            if recorder is not None:
+                for line in lines:
+                    recorder.write(capture_names[port], host_time, line)
+
+            relay_hit = False
+            if port == relay.port:
+                for line in lines:
+                    relay_hit |= update_relay(relay, line)
+            else:
+                node = nodes[port]
+                for line in lines:
+                    update_native(node, line)
+
+            if relay_hit:
+                scheduler.mark_dirty('coding', arrival=host_time)
                 if not start:
                     print('\nStarting to collect data')
                     start = True
                 
                 if last < relay.ReportSavings:
-                    update_relay_report_plot(fig_relay_recep_rep, RecepTransAx, relay, len(native_nodes))
+                    scheduler.mark_dirty('report', arrival=host_time)
                     last = relay.ReportSavings
                 if relay.shutdown:
                     break
@@ -350,29 +402,42 @@ def main():
                 update_native_bar_plot(fig_native_coding_gain, NatBarAx, native_nodes) """
 
             if shutdown_cnt == node_cnt-1:            # every node has shut down
-                #update_relay_coding_plot(fig_relay_coding_gain, RelTransAx, RelCodGainvAx, relay, , len(native_nodes))
+                #update_relay_coding_plot(relay_coding_view, relay, len(native_nodes))
                 #update_native_bar_plot(fig_native_coding_gain, NatBarAx, native_nodes)
                 break
 
+            metrics.parsed(time.perf_counter() - parse_start, events.qsize())
+            if metrics.poll(): scheduler.mark_dirty('coding')
+            if headless: emitter.poll(summarize)
+            scheduler.poll()
+
         except KeyboardInterrupt:
             print('Aborted data collection')
             break
         except Exception as ex:
             print(ex)
-            pass
-
+            metrics.count_error(ex)
+
+    scheduler.flush()                                   # draw the final state of the cycle
+    if headless: emitter.close(summarize())
+    print('\n' + metrics.close())
+
+    if subprocess_mode:
+        multiplexer.stop()
+    else:
+        stop_readers(readers)
+    print('ingested %d lines in %.1f s' % (line_cnt, time.perf_counter() - start_time))
+    if recorder is not None:
+        recorder.close()
+        print('recorded ' + str(recorder.count) + ' lines to ' + record_path)
     print('\n Cycle finished.')
 
-    while True:
+    while not headless:
         try:
             plt.show(block=True)
         except KeyboardInterrupt:
             break
 
-    relay.process.terminate()
-    for node in native_nodes:
-        node.process.terminate() 
-
     save_relay_values_to_file(relay, len(native_nodes))
 
     print('Done.')
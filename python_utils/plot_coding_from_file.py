@@ -5,39 +5,59 @@ import matplotlib.colors as mcolors
 import numpy as np
 import collections
 import os
-
-relay_file = '.\\export\\coding_plot\\relay_values_final.txt'
-
-def update_relay_coding_plot(fig_relay_coding_gain, RelCodGainvAx, data):
+from relay_store import relay_store, import_text_file
+from live_plot import minmax_indices
+
+#
+# Run:
+# `python ../python_utils/plot_coding_from_file.py` plots the newest stored run of every native node count
+# optional: -import [FILE] first copies a relay_values_final.txt style text file into the store (default: relay_file)
+#           -range START:STOP only plots the encoded native packets START..STOP-1 (default: all, either side may be left out)
+#           -stride N plots every Nth packet of the range
+#           -raw disables the min/max downsampling to the figure width
+# The stored series are memory-mapped, only the selected range is read and at most two points per pixel column are drawn.
+#
+
+relay_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'export', 'coding_plot', 'relay_values_final.txt')
+
+def select_packets(values, packet_range, buckets):                      # (x, y) to draw of a series, x counts the packets from 1
+    start, stop, stride = slice(*packet_range).indices(len(values))
+    view  = values[start:stop:stride]                                   # slice of the memory map, nothing is read yet
+    index = minmax_indices(view, buckets) if buckets else None
+    if index is None:
+        index = np.arange(len(view))
+    return start + index * stride + 1, np.asarray(view[index])
+
+def update_relay_coding_plot(fig_relay_coding_gain, RelCodGainvAx, data, packet_range=(None, None, 1), decimate=True):
     #RelTransAx.clear()
     RelCodGainvAx.clear()
 
     colors = ['tab:green', 'tab:blue', 'tab:purple' , 'tab:orange']
     
     max_len = 0
-    packet_range = 150
+    buckets = int(RelCodGainvAx.bbox.width) if decimate else 0        # min/max pairs per pixel column
     patches = []
 
     for i, node_cnt in enumerate(data):
-        transm = data[node_cnt]['transm'][:packet_range]
-        x_transm = np.arange(1, len(transm)+1, 1, dtype=np.int64)
+        color = colors[i % len(colors)]
+
+        x_transm, transm = select_packets(data[node_cnt]['transm'], packet_range, buckets)
         
-        cod_gain = data[node_cnt]['cod_gain'][:packet_range]
-        x_cod_gain = np.arange(1, len(cod_gain)+1, 1, dtype=np.int64)
+        x_cod_gain, cod_gain = select_packets(data[node_cnt]['cod_gain'], packet_range, buckets)
         #cod_gain_ideal = data[node_cnt]['cod_gain_ideal']
 
         #RelTransAx.plot(x_transm, transm, linestyle='-', color=colors[i])
         #RelTransAx.plot(x_transm, x_transm/cod_gain_ideal, linestyle='--', color=colors[i])
         
-        RelCodGainvAx.plot(x_cod_gain, cod_gain, linestyle='-', color=colors[i], label='measured')
-        RelCodGainvAx.axhline(data[node_cnt]['cod_gain_ideal'], linestyle='--', color=colors[i])
+        RelCodGainvAx.plot(x_cod_gain, cod_gain, linestyle='-', color=color, label='measured')
+        RelCodGainvAx.axhline(data[node_cnt]['cod_gain_ideal'], linestyle='--', color=color)
         
-        patches.append(mpatches.Patch(color=colors[i], label=f'{node_cnt} native nodes'))
+        patches.append(mpatches.Patch(color=color, label=f'{node_cnt} native nodes'))
 
-        if max_len < len(transm): max_len = len(transm)
-        if max_len < len(cod_gain): max_len = len(cod_gain)
+        if len(x_transm) and max_len < x_transm[-1]: max_len = x_transm[-1]
+        if len(x_cod_gain) and max_len < x_cod_gain[-1]: max_len = x_cod_gain[-1]
 
-    nocoding = np.arange(1, max_len+1, 1, dtype=np.int64)
+    #nocoding = np.arange(1, max_len+1, 1, dtype=np.int64)
     #RelTransAx.plot(nocoding, nocoding, linestyle='--', color='tab:red', label='nomal broadcasting')
     RelCodGainvAx.axhline(1, linestyle='--', color='tab:red')
 
@@ -61,32 +81,31 @@ def update_relay_coding_plot(fig_relay_coding_gain, RelCodGainvAx, data):
     fig_relay_coding_gain.tight_layout()
     fig_relay_coding_gain.canvas.flush_events()
 
-def parse_values_from_file(filename):
-    data = {}
-    with open(filename, 'r') as file:
-        lines = file.readlines()
-
-    node_cnt = None
-    for line in lines:
-        if line.startswith("Values for"):
-            node_cnt = int(line.split()[2])
-            data[node_cnt] = {}
-        elif line.strip() and node_cnt is not None:
-            key, values = line.strip().split(":")
-            if key in ["transm", "cod_gain"]:
-                data[node_cnt][key] = np.fromstring(values, sep=',', dtype=float)
-            elif key in ["cod_gain_avg", "cod_gain_ideal"]:
-                data[node_cnt][key] = float(values)
-
-    return data
+def load_values_from_store(store):                                     # native_cnt -> series (memory mapped) and scalars of its newest run
+    return {native_cnt: store.load(key) for native_cnt, key in store.latest().items()}
 
 def main():
 
-    data = parse_values_from_file(relay_file)
+    args  = sys.argv
+    store = relay_store()
+    if '-import' in args:
+        index       = args.index('-import')
+        import_file = args[index+1] if index+1 < len(args) and not args[index+1].startswith('-') else relay_file
+        print('Imported ' + ', '.join(import_text_file(import_file, store)) + ' from ' + import_file)
+
+    data = load_values_from_store(store)
+    if not data:
+        print('No relay values stored yet, run plot_coding_data.py or use -import')
+        sys.exit()
+
+    range_arg    = args[args.index('-range')+1] if '-range' in args else ':'
+    start, stop  = [int(bound) if bound else None for bound in range_arg.split(':')]
+    stride       = int(args[args.index('-stride')+1]) if '-stride' in args else 1
+    decimate     = '-raw' not in args
 
     fig_relay_coding_gain, RelCodGainvAx = plt.subplots(figsize=(10, 6))
 
-    update_relay_coding_plot(fig_relay_coding_gain, RelCodGainvAx, data)
+    update_relay_coding_plot(fig_relay_coding_gain, RelCodGainvAx, data, (start, stop, stride), decimate)
 
     try:
         plt.show()
@@ -1,35 +1,51 @@
 import sys
-import serial
 import os
-import matplotlib.pyplot as plt
-import numpy as np
-import collections
+import queue
 import time
+import shutil
+import numpy as np
 from datetime import datetime
+from serial_reader import configure_serial, start_readers, stop_readers
+from streaming_stats import running_linreg
+from buffers import ring_buffer
+from live_plot import blit_figure, render_scheduler, fit_range, pyplot
+from obsv_frames import decode_frames, edge_events, edge_lines, edge_rising, format_edge_line
+from capture import capture_writer, capture_reader, capture_ports
+from sync_analyzer import cycle_analyzer
+from metrics import pipeline_metrics
+from headless import summary_emitter, summary_interval
 
 #
 # Run:
-# `python ../python_utils/plot_sync_data.py -obsv COMX -peer COMY` with COMX and COMY being the port of the observer and slave peer
+# `python ../python_utils/plot_sync_data.py -obsv COMX -peer1 COMY -peer2 COMZ` with COMX being the port of the observer and COMY, COMZ the ports of the peers
+# or `-peers COMY,COMZ,...` for up to 7 peers, each one wired to its own observer GPIO
+# optional: -fps N caps the redraw rate of the figures (default 30)
+# optional: -binary if the observer was built with CONFIG_OBSERVER_BINARY_FRAMES
+# optional: -record FILE appends every received line to a capture file, with -save a copy goes next to the figures as capture.log
+# optional: -replay FILE runs a capture through the parsers and plots as fast as possible instead of reading the boards
+#           (per-line console output is skipped unless -verbose is given, the figures are drawn once at the end)
+# optional: -metrics FILE appends the pipeline metrics (see metrics.py) once per second as json lines
+# optional: -status shows the pipeline metrics as an overlay on the deviation figure
+# optional: -headless no figures and no matplotlib import, a summary of the statistics (sync_summary) is written every
+#           second instead, -every S changes the interval, -json writes json lines, -summary FILE appends them to FILE
+#           instead of stdout (keeps them apart from the console messages)
 #
 
-def append_time(timestamp):
-    return timestamp, int(time.time_ns()/1e3)
-
-def configure_serial(port):
-    ser = serial.Serial()
-    ser.baudrate = 921600
-    ser.port = port
-    ser.parity = 'N'
-    ser.timeout = 0.0000000001
+hist_bins    = 50                                                       # bins of the distribution plots
+drift_origin = ['added', 'estimated', 'computed']                       # bars of the clock drift comparison, after one bar per peer
+peer_colors  = ['r', 'b', 'g', 'm', 'c', 'y', 'k']                      # one per observer gpio
+verbose      = True                                                     # print the per-line progress, off for replays
+export_dir   = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'export')  # -save puts the figures of a run below it, whatever the cwd
+figure_files = {'deviation': 'figure_measure.png', 'offset': 'figure_peer.png', 'api': 'send_receive_delays.png', 'pairs': 'figure_pairs.png'}
 
-    try:
-        ser.open()
-    except Exception as e:
-        print(e)
-        sys.exit()
+class peer_state:
 
-    ser.reset_input_buffer()
-    return ser
+    def __init__(self, name, maxlen):
+        self.name           = name
+        self.systime        = running_linreg(maxlen)                    # (host time, peer systime)
+        self.comp_offsets   = running_linreg(maxlen)                    # (host time, offset to the master the peer computed), empty for the master
+        self.send_offsets   = ring_buffer(maxlen)
+        self.recv_offsets   = ring_buffer(maxlen)
 
 def compute_cycle_durations(first_timestamp_rising, last_timestamp_rising, first_timestamp_rising_last_cycle, last_timestamp_rising_last_cycle, peer1_cycle_durations, peer2_cycle_durations):
     
@@ -44,141 +60,211 @@ def compute_cycle_durations(first_timestamp_rising, last_timestamp_rising, first
     print('cycle duration peer1: ' + str(cycle_dur1))
     print('cycle duration peer2: ' + str(cycle_dur2))
 
-def process_obsv_deviation(line, measured_delta, first_timestamp, last_timestamp, first_timestamp_old, last_timestamp_old, new_cycle, measure_index):
-    # parse line
-    timestamp = int(line.split()[-1])
-
-    if new_cycle:
-        max_offset = abs(last_timestamp - first_timestamp)
-        if max_offset != 0: measured_delta.append(max_offset)
-        print('found delta t = ' + str(max_offset))
-        print('------------------')
-        measure_index += 1
-        
-        first_timestamp_old = first_timestamp
-        last_timestamp_old  = last_timestamp
-
-        first_timestamp = timestamp
-        new_cycle = False
-    else:
-        last_timestamp = timestamp
-
-    return measured_delta, first_timestamp, last_timestamp, first_timestamp_old, last_timestamp_old, new_cycle, measure_index 
-
-def process_peer_comp_offset(line, peer_offsets, peer_comp_offsets_time):
-    parts = line.split()
-    offset = abs(int(parts[parts.index('with')+1]))
-    peer_offsets.append(offset)
-    peer_comp_offsets_time.append(int(int(time.time_ns()/1e3)))
-    print('computed offset to master: '+str(offset))
-
-def refresh_deviation_plot(fig, line_ax, pd_ax, measured_delta):
-    line_ax.clear()
-    pd_ax.clear()
-    
-    if len(measured_delta) <= 1: return
-
-    y = np.asarray(measured_delta, dtype=np.int64)[1:]  # exclude the first element, it's garbage
-    
-    y_avg = sum(y) / len(y)
-    y_min = min(y)
-    y_max = max(y)
+def process_peer_comp_offset(offset, host_time, peer):
+    peer.comp_offsets.append(host_time // 1000, offset)                 # host receive time in [us], signed so the peers can be compared
+    if verbose: print(peer.name + ' computed offset to master: '+str(offset))
+
+def process_peer_line(line, host_time, peer):                           # returns the event of the line for the CONFIG / RESETTING checks
+    if 'Offset to master with' in line:
+        parts = line.split()
+        offset = int(parts[parts.index('with')+1])
+        process_peer_comp_offset(offset, host_time, peer)
+        return ('peer_offset', offset)
+    if 'Systime at' in line:
+        parts = line.split()
+        systime = int(parts[parts.index('at')+1])
+        peer.systime.append(host_time // 1000, systime)
+        return ('peer_systime', systime)
+    if 'avg_send_offset = ' in line:
+        parts = line.split()
+        offset = int(parts[parts.index('=')+1])
+        peer.send_offsets.append(offset)
+        return ('peer_send', offset)
+    if 'avg_recv_offset = ' in line:
+        parts = line.split()
+        offset = int(parts[parts.index('=')+1])
+        peer.recv_offsets.append(offset)
+        return ('peer_recv', offset)
+    if 'CONFIG: ' in line:
+        parts = line.split()
+        return ('peer_config', parts[parts.index('CONFIG:')+1])
+    if 'RESETTING NETWORK' in line:
+        return ('peer_reset',)
+    return None
+
+def init_deviation_plot(fig, line_ax, pd_ax):
+    view = blit_figure(fig)
 
-    x_range = range(1, len(y)+1)
-    
     # line plot in the first subplot (ax1)
     line_ax.set_title("measured time deviation between peers")
-    line_ax.plot(x_range, y, color='b')
-    line_ax.axhline(y_avg, color='b', linestyle='--', label=f'avg: {int(y_avg)} [\u00b5s]')
-    line_ax.axhline(y_min, color='r', linestyle='--', label=f'min: {int(y_min)} [\u00b5s]')
-    line_ax.axhline(y_max, color='g', linestyle='--', label=f'max: {int(y_max)} [\u00b5s]')
+    view.delta_line = view.add(line_ax.plot([], [], color='b')[0])
+    view.avg_line   = view.add(line_ax.axhline(0, color='b', linestyle='--', label='avg'))
+    view.min_line   = view.add(line_ax.axhline(0, color='r', linestyle='--', label='min'))
+    view.max_line   = view.add(line_ax.axhline(0, color='g', linestyle='--', label='max'))
     line_ax.set_ylabel("\u0394t [\u00b5s]")
     line_ax.set_xlabel("cycle index")
-    line_ax.legend(loc='upper right')
+    view.legend     = view.add(line_ax.legend(loc='upper right'))
     line_ax.grid(True)
 
     # histogram in the second subplot (ax2)
     pd_ax.set_title("peer-offset distribution")
-    pd_ax.hist(y, bins=50, color='blue', cumulative=False, density=True, alpha=0.7)
+    view.hist = view.add(pd_ax.stairs(np.zeros(2*hist_bins), np.arange(2*hist_bins+1), fill=True, color='blue', alpha=0.7))
     pd_ax.set_ylabel("probability density")
     pd_ax.set_xlabel("\u0394t [\u00b5s]")
     pd_ax.grid(True)
 
-    fig.tight_layout()
-    fig.canvas.flush_events()
+    return view
+
+def refresh_deviation_plot(view, measured_delta):
+    if len(measured_delta) == 0: return
 
-def refresh_offset_drift_plot(fig_offset, peer_systime_ax, diff_ax, peer_comp_offsets, peer_comp_offsets_time, peer1_systime, peer2_systime, fig_drift, drift_ax):
-    peer_systime_ax.clear()
-    diff_ax.clear()
-    drift_ax.clear()
+    y = measured_delta.values()
     
-    if len(peer_comp_offsets) <= 1 or len(peer_comp_offsets_time) <= 1 or len(peer1_systime) <= 1 or len(peer2_systime) <= 1: return
+    # statistics are kept up to date by the histogram, no rescan of the window
+    y_avg = measured_delta.mean()
+    y_min = measured_delta.min()
+    y_max = measured_delta.max()
 
-    time_reference_point = min([peer1_systime[0][1], peer2_systime[0][1]])
+    x_range = np.arange(1, len(y)+1)
+    
+    view.set_line_data(view.delta_line, x_range, y)
+    view.avg_line.set_ydata([y_avg, y_avg])
+    view.min_line.set_ydata([y_min, y_min])
+    view.max_line.set_ydata([y_max, y_max])
+    labels = [f'avg: {int(y_avg)} [\u00b5s]', f'min: {int(y_min)} [\u00b5s]', f'max: {int(y_max)} [\u00b5s]']
+    for text, label in zip(view.legend.get_texts(), labels):
+        text.set_text(label)
+    view.fit_limits(view.delta_line.axes, 1, len(y), y_min, y_max)
 
-    p1_systime = np.asarray([x[0] for x in peer1_systime], dtype=np.int64)
-    p2_systime = np.asarray([x[0] for x in peer2_systime], dtype=np.int64)
-    p1_range   = np.asarray([y[1] for y in peer1_systime], dtype=np.int64) - time_reference_point
-    p2_range   = np.asarray([y[1] for y in peer2_systime], dtype=np.int64) - time_reference_point
+    density = measured_delta.density()
+    view.hist.set_data(density, measured_delta.edges())
+    view.fit_limits(view.hist.axes, y_min, y_max + measured_delta.width, 0, density.max())
 
-    p1_systime_lin_reg = np.poly1d(np.polyfit(p1_range, p1_systime, 1))
-    p2_systime_lin_reg = np.poly1d(np.polyfit(p2_range, p2_systime, 1))
+    view.refresh()
 
-    if p1_systime_lin_reg[0] >= p2_systime_lin_reg[0]:                  # basically abs
-        estim_offset_lin_reg = p1_systime_lin_reg - p2_systime_lin_reg 
-    else:
-        estim_offset_lin_reg = p2_systime_lin_reg - p1_systime_lin_reg 
-    
-    comp_offset       = np.asarray(peer_comp_offsets, dtype=np.int64)
-    comp_offset_range = np.asarray(peer_comp_offsets_time, dtype=np.int64) - time_reference_point
-    comp_lin_reg      = np.poly1d(np.polyfit(comp_offset_range, comp_offset, 1))
+def init_pairwise_plot(fig, pair_ax, gpios):
+    view = blit_figure(fig)
+
+    pair_ax.set_title("mean deviation between observer channels")
+    view.image = view.add(pair_ax.imshow(np.full((len(gpios), len(gpios)), np.nan), cmap='viridis', vmin=0, vmax=1))
+    labels = ['GPIO' + str(gpio) for gpio in gpios]
+    pair_ax.set_xticks(range(len(gpios)), labels, rotation=45)
+    pair_ax.set_yticks(range(len(gpios)), labels)
+    fig.colorbar(view.image, ax=pair_ax, label="\u0394t [\u00b5s]")
+
+    return view
 
-    cycle_durations   = [comp_offset_range[i+1] - comp_offset_range[i] for i in range(len(comp_offset_range)-1)]
-    avg_cycle_duration= int(sum(cycle_durations)/len(cycle_durations))
-    print('average cycle duration '+str(avg_cycle_duration))
+def refresh_pairwise_plot(view, analyzer):
+    if analyzer.filled == 0: return
+
+    mean, high = analyzer.pair_deviation()
+    if np.isnan(mean).all(): return
+
+    view.image.set_data(mean)
+    limits = fit_range(view.image.get_clim(), 0, np.nanmax(mean))
+    if limits is not None:                                              # the colorbar is part of the background
+        view.image.set_clim(limits)
+        view.stale = True
+
+    view.refresh()
+
+def init_offset_drift_plot(fig_offset, peer_systime_ax, diff_ax, fig_drift, drift_ax, peer_names):
+    offset_view = blit_figure(fig_offset)
 
     peer_systime_ax.set_title("per-cycle average systime-offsets to oldest Peer")
-    peer_systime_ax.plot(comp_offset_range/1e6, comp_offset/1e3, 'r-', label='computed offset')
-    #peer_systime_ax.plot(comp_offset_range/1e6, comp_lin_reg(comp_offset_range), 'r--', label='linear regression')
-    peer_systime_ax.plot(comp_offset_range/1e6, estim_offset_lin_reg(comp_offset_range)/1e3, 'g--', label='estimated offset')
-    """ peer_systime_ax.plot(p1_range, p1_systime, 'or-', label='peer1 systime')
-    peer_systime_ax.plot(p2_range, p2_systime, 'ob-', label='peer2 systime')
-    peer_systime_ax.plot(p1_lin_reg, 'r--' , label='linear regression')
-    peer_systime_ax.plot(p2_systime, 'ob-', label='peer1 systime')
-    peer_systime_ax.plot(p2_lin_reg, 'b--' , label='linear regression') """
+    offset_view.comp_line  = offset_view.add(peer_systime_ax.plot([], [], 'r-', label='computed offset')[0])
+    #offset_view.comp_reg_line = offset_view.add(peer_systime_ax.plot([], [], 'r--', label='linear regression')[0])
+    offset_view.estim_line = offset_view.add(peer_systime_ax.plot([], [], 'g--', label='estimated offset')[0])
     peer_systime_ax.set_ylabel("\u0394t [ms]")
     peer_systime_ax.set_xlabel("time [s]")
-    peer_systime_ax.legend(loc = 'lower right')
+    offset_view.add(peer_systime_ax.legend(loc = 'lower right'))
     peer_systime_ax.grid(True)
-    
-    estim_comp_difference = (comp_offset-estim_offset_lin_reg(comp_offset_range))/1e3
 
     diff_ax.set_title("distribution of per-cycle systime-offsets")
-    #diff_ax.plot(comp_offset_range/1e6, abs(estim_offset_lin_reg(comp_offset_range)-comp_offset), color='g', label='time drift')
-    diff_ax.hist(estim_comp_difference, bins=50, color='blue', cumulative=False, density=True, alpha=0.7)
+    offset_view.hist = offset_view.add(diff_ax.stairs(np.zeros(hist_bins), np.arange(hist_bins+1), fill=True, color='blue', alpha=0.7))
     diff_ax.set_ylabel("probability density")
     diff_ax.set_xlabel("\u0394t [ms]")
-    #diff_ax.legend()
 
-    peer1_drift = abs(p1_systime_lin_reg[1]-1)*1e6
-    peer2_drift = abs(p2_systime_lin_reg[1]-1)*1e6
-    added_drift = peer1_drift + peer2_drift
-    estim_drift = abs(estim_offset_lin_reg[1])*1e6
-    comp_drift  = abs(comp_lin_reg[1])*1e6
+    drift_view = blit_figure(fig_drift)
+
+    drift_ax.set_title('clock drift comparison')
+    bar_names = peer_names + drift_origin
+    drift_view.bars = drift_view.add_all(drift_ax.bar(bar_names, [0]*len(bar_names)).patches)
+    drift_ax.set_ylabel('clock drift [ppm]')
+
+    return offset_view, drift_view
+
+def offset_drift_stats(peers):                                          # offsets and drifts of the fitted peer clocks, None until two peers are fitted
+    fitted    = [peer for peer in peers if len(peer.systime) > 1]
+    reporting = [peer for peer in peers if len(peer.comp_offsets) > 1]  # peers that computed their offset to the master
+    if not reporting or len(fitted) < 2: return None
+
+    time_reference_point = min([peer.systime[0][0] for peer in fitted])
+
+    # regressions come from running sums, no refit over the window
+    systime_lin_regs = [peer.systime.poly(time_reference_point) for peer in fitted]
+    slopes           = np.array([lin_reg[1] for lin_reg in systime_lin_regs])
+    
+    # computed offset = spread between the peers' own offsets to the master, every peer but the master reports one per
+    # cycle, so their last reports are lined up cycle by cycle, the master (a peer that reports none) is at offset 0
+    # and a peer with a single report so far stays at that offset, its drift is only known from the second one on
+    cnt               = min(len(peer.comp_offsets) for peer in reporting)
+    comp_samples      = [peer.comp_offsets.arrays() for peer in reporting]
+    comp_offset_range = comp_samples[0][0][-cnt:] - time_reference_point
+    comp_offsets      = [offsets[-cnt:] for _, offsets in comp_samples]
+    comp_offsets     += [np.full(cnt, peer.comp_offsets[-1][1], dtype=np.int64) for peer in peers if len(peer.comp_offsets) == 1]
+    comp_slopes       = [peer.comp_offsets.slope() for peer in reporting]
+    if any(len(peer.comp_offsets) == 0 for peer in peers):
+        comp_offsets.append(np.zeros(cnt, dtype=np.int64))
+        comp_slopes.append(0.0)
+    comp_offsets      = np.array(comp_offsets)
+    comp_offset       = comp_offsets.max(axis=0) - comp_offsets.min(axis=0)
+
+    avg_cycle_duration= int((comp_offset_range[-1] - comp_offset_range[0]) / (len(comp_offset_range)-1))
+    if verbose: print('average cycle duration '+str(avg_cycle_duration))
+
+    # estimated offset = spread between the earliest and the latest fitted peer clock, evaluated for all peers at once
+    fitted_systimes = np.array([lin_reg(comp_offset_range) for lin_reg in systime_lin_regs])
+    estim_offset    = fitted_systimes.max(axis=0) - fitted_systimes.min(axis=0)
+
+    drifts      = {peer.name: abs(lin_reg[1]-1)*1e6 for peer, lin_reg in zip(fitted, systime_lin_regs)}
+    peer_drifts = [drifts.get(peer.name, 0) for peer in peers]
+    added_drift = sum(sorted(peer_drifts)[-2:])                         # worst pair, the two peers drifting the most in opposite directions
+    estim_drift = (slopes.max() - slopes.min())*1e6
+    comp_drift  = (max(comp_slopes) - min(comp_slopes))*1e6
+
+    return {'time': comp_offset_range, 'comp_offset': comp_offset, 'estim_offset': estim_offset, 'cycle_duration': avg_cycle_duration,
+            'peer_drifts': peer_drifts, 'added_drift': added_drift, 'estim_drift': estim_drift, 'comp_drift': comp_drift}
+
+def refresh_offset_drift_plot(offset_view, drift_view, peers):
+    stats = offset_drift_stats(peers)
+    if stats is None: return
+
+    x_time      = stats['time']/1e6
+    y_comp      = stats['comp_offset']/1e3
+    y_estim     = stats['estim_offset']/1e3
+    offset_view.set_line_data(offset_view.comp_line, x_time, y_comp)
+    offset_view.estim_line.set_data(x_time, y_estim)
+    offset_view.fit_limits(offset_view.comp_line.axes, x_time[0], x_time[-1], min(y_comp.min(), y_estim.min()), max(y_comp.max(), y_estim.max()))
     
-    origin     = ['peer1', 'peer2', 'added', 'estimated', 'computed']
-    drift_values  = [peer1_drift, peer2_drift, added_drift, estim_drift, comp_drift]
+    estim_comp_difference = (stats['comp_offset']-stats['estim_offset'])/1e3
+
+    # the residuals move with every refit of the estimated offset, so they are binned per refresh instead of streamed
+    density, edges = np.histogram(estim_comp_difference, bins=hist_bins, density=True)
+    offset_view.hist.set_data(density, edges)
+    offset_view.fit_limits(offset_view.hist.axes, edges[0], edges[-1], 0, density.max())
+
+    drift_values  = stats['peer_drifts'] + [stats['added_drift'], stats['estim_drift'], stats['comp_drift']]
     
     """ for i in range(len(drift_values)):
-        print(origin[i]+': '+str(drift_values[i])) """
+        print(drift_origin[i]+': '+str(drift_values[i])) """
 
-    drift_ax.set_title('clock drift comparison')
-    drift_ax.bar(origin, drift_values)
-    drift_ax.set_ylabel('clock drift [ppm]')
+    for bar, value in zip(drift_view.bars, drift_values):
+        bar.set_height(value)
+    drift_view.fit_ylim(drift_view.bars[0].axes, 0, max(drift_values))
     
-    fig_offset.tight_layout()
-    fig_offset.canvas.flush_events()
-    fig_drift.canvas.flush_events()
+    offset_view.refresh()
+    drift_view.refresh()
 
 """ def refresh_systime_plot(fig_systime, sys_ax, peer1_systime, peer2_systime):
     sys_ax.clear()
@@ -221,39 +307,39 @@ def refresh_offset_drift_plot(fig_offset, peer_systime_ax, diff_ax, peer_comp_of
     fig_systime.tight_layout()
     fig_systime.canvas.flush_events() """
 
-def refresh_api_plot(fig, send_ax, recv_ax, peer1_send_offsets, peer2_send_offsets, peer1_recv_offsets, peer2_recv_offsets):
-    send_ax.clear()
-    recv_ax.clear()
-
-    p1_send = np.asarray(peer1_send_offsets, dtype=np.int64)[1:]
-    p2_send = np.asarray(peer2_send_offsets, dtype=np.int64)[1:]
-    p1_recv = np.asarray(peer1_recv_offsets, dtype=np.int64)[1:]
-    p2_recv = np.asarray(peer2_recv_offsets, dtype=np.int64)[1:]
-
-    p1_send_range = range(1, len(p1_send) + 1)
-    p2_send_range = range(1, len(p2_send) + 1)
-    p1_recv_range = range(1, len(p1_recv) + 1)
-    p2_recv_range = range(1, len(p2_recv) + 1)
+def init_api_plot(fig, send_ax, recv_ax, peer_names):
+    view = blit_figure(fig)
 
     # line plot of send offsets
     send_ax.set_title("per-cycle average send offsets")
-    send_ax.plot(p1_send_range, p1_send, color='r', label='peer 1')
-    send_ax.plot(p2_send_range, p2_send, color='b', label='peer 2')
+    view.send_lines = [view.add(send_ax.plot([], [], color=peer_colors[i], label='peer '+str(i+1))[0]) for i in range(len(peer_names))]
     send_ax.set_ylabel("t [\u00b5s]")
     send_ax.set_xlabel("Cycle Index")
-    send_ax.legend(loc='center right')
+    view.add(send_ax.legend(loc='center right'))
     send_ax.grid(True)
     # line plot of receive offsets
     recv_ax.set_title("per-cycle average receive offsets")
-    recv_ax.plot(p1_recv_range, p1_recv, color='r', label='peer 1')
-    recv_ax.plot(p2_recv_range, p2_recv, color='b', label='peer 2')
+    view.recv_lines = [view.add(recv_ax.plot([], [], color=peer_colors[i], label='peer '+str(i+1))[0]) for i in range(len(peer_names))]
     recv_ax.set_ylabel("t [\u00b5s]")
     recv_ax.set_xlabel("Cycle Index")
-    recv_ax.legend(loc='center right')
+    view.add(recv_ax.legend(loc='center right'))
     recv_ax.grid(True)
 
-    fig.tight_layout()
-    fig.canvas.flush_events()
+    return view
+
+def refresh_api_plot(view, peers):
+    send = [peer.send_offsets.values()[1:] for peer in peers]
+    recv = [peer.recv_offsets.values()[1:] for peer in peers]
+
+    for line, y in zip(view.send_lines + view.recv_lines, send + recv):
+        view.set_line_data(line, np.arange(1, len(y) + 1), y)
+
+    for ax, series in ((view.send_lines[0].axes, send), (view.recv_lines[0].axes, recv)):
+        values = np.concatenate(series)
+        if len(values) == 0: continue
+        view.fit_limits(ax, 1, max(len(y) for y in series), values.min(), values.max())
+
+    view.refresh()
 
 """ def refresh_cycle_drift_plot(fig, ax_cycle_dur, ax_drift, peer_real_offsets, peer1_cycle_durations, peer2_cycle_durations):
     ax_cycle_dur.clear()
@@ -298,70 +384,144 @@ def refresh_api_plot(fig, send_ax, recv_ax, peer1_send_offsets, peer2_send_offse
     fig.tight_layout()
     fig.canvas.flush_events() """
 
-def main():
-
-    args = sys.argv
-    port_obsv   = args[args.index('-obsv')+1]    if '-obsv'  in args else ''
-    port_peer1   = args[args.index('-peer1')+1]  if '-peer1' in args else ''
-    port_peer2   = args[args.index('-peer2')+1]  if '-peer2' in args else ''
-    measure_cnt = int(args[args.index('-measure')+1]) if '-measure'  in args else 100
-    save_plots = True if '-save' in args else False
-
-    ser_obsv  = configure_serial(port_obsv)
-    ser_peer1 = configure_serial(port_peer1)
-    ser_peer2 = configure_serial(port_peer2)
-
-    plt.ion()
+def sync_summary(analyzer, peers):                  # scalar statistics of a measurement window, used by batch_analyze
+    spread  = analyzer.spread
+    summary = {'cycles': analyzer.cycles, 'samples': len(spread),
+               'dt_mean': float(spread.mean()), 'dt_min': float(spread.min()), 'dt_max': float(spread.max()), 'dt_p99': float(spread.percentile(99))}
+    if analyzer.filled:
+        mean, high = analyzer.pair_deviation()
+        if not np.isnan(high).all():
+            summary['pair_dt_max'] = float(np.nanmax(high))
+
+    stats = offset_drift_stats(peers)
+    if stats is not None:
+        summary['cycle_duration'] = stats['cycle_duration']
+        for peer, drift in zip(peers, stats['peer_drifts']):
+            summary[peer.name + '_drift_ppm'] = float(drift)
+        summary['added_drift_ppm']     = float(stats['added_drift'])
+        summary['estimated_drift_ppm'] = float(stats['estim_drift'])
+        summary['computed_drift_ppm']  = float(stats['comp_drift'])
+    return summary
+
+def init_figures(peer_names, gpios):                                    # name -> view of every figure, shared by the live loop and batch_analyze
+    plt = pyplot()
     fig_obsv, (obsv_line_ax, obsv_pd_ax)   = plt.subplots(2, 1, figsize=(10, 6), sharex=False)
     fig_peer, (peer_line_ax, peer_diff_ax) = plt.subplots(2, 1, figsize=(10, 6), sharex=False)
     fig_send_recv, (send_ax, recv_ax)      = plt.subplots(2, 1, figsize=(10, 6), sharex=False)
     #fig_systime, sys_ax                    = plt.subplots(2, 1, figsize=(10, 6), sharex=False)
     fig_drift, drift_ax                    = plt.subplots(1, 1, figsize=(10, 6))
+    fig_pairs, pair_ax                     = plt.subplots(1, 1, figsize=(8, 6))
 
-    measured_delta = collections.deque(maxlen=measure_cnt)
-    measure_index = 0
-    new_cycle = True
-    first_timestamp_rising = 0
-    last_timestamp_rising = 0
+    views = {}
+    views['deviation']                = init_deviation_plot(fig_obsv, obsv_line_ax, obsv_pd_ax)
+    views['offset'], views['drift']   = init_offset_drift_plot(fig_peer, peer_line_ax, peer_diff_ax, fig_drift, drift_ax, peer_names)
+    views['api']                      = init_api_plot(fig_send_recv, send_ax, recv_ax, peer_names)
+    views['pairs']                    = init_pairwise_plot(fig_pairs, pair_ax, gpios)
+    return views
 
-    first_timestamp_rising_last_cycle = 0
-    last_timestamp_rising_last_cycle  = 0
+def save_figures(views, subdir):
+    for name, filename in figure_files.items():
+        views[name].savefig(os.path.join(subdir, filename))
 
-    """ peer1_cycle_durations = collections.deque(maxlen=measure_cnt)
-    peer2_cycle_durations = collections.deque(maxlen=measure_cnt) """
+def close_figures(views):
+    for view in views.values():
+        pyplot().close(view.fig)
 
-    peer_comp_offsets      = collections.deque(maxlen=measure_cnt)
-    peer_comp_offsets_time = collections.deque(maxlen=measure_cnt)
-    
-    peer1_systime = collections.deque(maxlen=measure_cnt)
-    peer2_systime = collections.deque(maxlen=measure_cnt)
+def main():
+    global verbose
 
-    peer1_send_offsets = collections.deque(maxlen=measure_cnt)
-    peer2_send_offsets = collections.deque(maxlen=measure_cnt)
+    args = sys.argv
+    port_obsv   = args[args.index('-obsv')+1]    if '-obsv'  in args else ''
+    port_peer1   = args[args.index('-peer1')+1]  if '-peer1' in args else ''
+    port_peer2   = args[args.index('-peer2')+1]  if '-peer2' in args else ''
+    measure_cnt = int(args[args.index('-measure')+1]) if '-measure'  in args else 100
+    save_plots = True if '-save' in args else False
+    max_fps     = float(args[args.index('-fps')+1]) if '-fps' in args else 30
+    binary_obsv = True if '-binary' in args else False
+    peer_ports  = args[args.index('-peers')+1].split(',') if '-peers' in args else [port_peer1, port_peer2]
+    record_path = args[args.index('-record')+1] if '-record' in args else ''
+    replay_path = args[args.index('-replay')+1] if '-replay' in args else ''
+    metrics_path= args[args.index('-metrics')+1] if '-metrics' in args else ''
+    headless    = '-headless' in args
+    summary_path= args[args.index('-summary')+1] if '-summary' in args else ''
+    summary_every = float(args[args.index('-every')+1]) if '-every' in args else summary_interval
+    verbose     = '-verbose' in args or not (replay_path or headless)
+
+    if replay_path:
+        peer_names = sorted((port for port in capture_ports(replay_path) if port.startswith('peer')), key=lambda name: int(name[4:]))
+    else:
+        serial_ports = {'obsv': configure_serial(port_obsv)}
+        peer_names   = ['peer' + str(i+1) for i in range(len(peer_ports))]
+        for name, port in zip(peer_names, peer_ports):
+            serial_ports[name] = configure_serial(port)
+    peers = {name: peer_state(name, measure_cnt) for name in peer_names} # port name -> peer_state, peer1 is the one reporting CONFIG
+
+    analyzer = cycle_analyzer(measure_cnt, bins=2*hist_bins, verbose=verbose)   # adaptive edges, about half of the bins end up covered
+    if headless:
+        views   = {}                                                    # same parsing and statistics, only the figures are left out
+        emitter = summary_emitter(summary_path, '-json' in args, summary_every)
+    else:
+        pyplot().ion()
+        views   = init_figures(peer_names, analyzer.gpios)
 
-    peer1_recv_offsets = collections.deque(maxlen=measure_cnt)
-    peer2_recv_offsets = collections.deque(maxlen=measure_cnt)
+    """ peer1_cycle_durations = collections.deque(maxlen=measure_cnt)
+    peer2_cycle_durations = collections.deque(maxlen=measure_cnt) """
 
     once = True
     subdir = ''
 
+    metrics = pipeline_metrics(metrics_path)
+    if '-status' in args and views:
+        metrics.attach(views['deviation'])
+    summarize = lambda: dict({'config': subdir}, **sync_summary(analyzer, list(peers.values())))
+
+    # figures are only marked dirty while parsing, the scheduler redraws them at most max_fps times per second
+    scheduler = render_scheduler(max_fps, metrics)
+    if views:                                                           # headless: nothing registered, marking dirty is a no-op
+        scheduler.add('deviation', lambda: refresh_deviation_plot(views['deviation'], analyzer.spread))
+        scheduler.add('pairs', lambda: refresh_pairwise_plot(views['pairs'], analyzer))
+        scheduler.add('offset_drift', lambda: refresh_offset_drift_plot(views['offset'], views['drift'], list(peers.values())))
+        scheduler.add('api', lambda: refresh_api_plot(views['api'], list(peers.values())))
+
+    if replay_path:
+        events, readers = capture_reader(replay_path), []               # same get() as the reader queue
+        live            = False                                         # no intermediate frames, only the final one
+    else:
+        events, readers = start_readers(serial_ports, {'obsv': decode_frames} if binary_obsv else {}, metrics)
+        live            = True
+    recorder = capture_writer(record_path, 'plot_sync_data') if record_path else None
+
     while True:
         try:
-            obsv_line = ser_obsv.readline(-1).decode().strip()
-            if 'RISING' in obsv_line:
-                measured_delta, first_timestamp_rising, last_timestamp_rising, first_timestamp_rising_last_cycle, last_timestamp_rising_last_cycle, new_cycle, measure_index = process_obsv_deviation(obsv_line, measured_delta, first_timestamp_rising, last_timestamp_rising, first_timestamp_rising_last_cycle, last_timestamp_rising_last_cycle, new_cycle, measure_index)
-                print(obsv_line)
-            if 'FALLING' in obsv_line:
-                
-                refresh_deviation_plot(fig_obsv, obsv_line_ax, obsv_pd_ax, measured_delta)                
-                
-                if not new_cycle: 
-                    #refresh_systime_plot(fig_systime, sys_ax, peer1_systime, peer2_systime)
-                    refresh_offset_drift_plot(fig_peer, peer_line_ax, peer_diff_ax, peer_comp_offsets, peer_comp_offsets_time, peer1_systime, peer2_systime, fig_drift, drift_ax)
-                
-                new_cycle = True
-                refresh_api_plot(fig_send_recv, send_ax, recv_ax, peer1_send_offsets, peer2_send_offsets, peer1_recv_offsets, peer2_recv_offsets)
-                
+            try:
+                port, host_time, lines = events.get(timeout=scheduler.timeout(0.1))     # block until any reader delivers a batch
+            except queue.Empty:
+                if metrics.poll(): scheduler.mark_dirty('deviation')
+                if headless: emitter.poll(summarize)
+                scheduler.poll()
+                continue
+            parse_start = time.perf_counter()
+            arrival     = host_time if live else None                   # replayed host times come from another session
+
+            if recorder is not None:                                    # binary frames are stored as their text lines
+                for raw_line in (edge_lines(lines) if port == 'obsv' else lines):
+                    recorder.write(port, host_time, raw_line)
+
+            if port == 'obsv':
+                # a batch of text lines or of binary frames, both yield (gpio, edge, timestamp)
+                for gpio, edge, timestamp in edge_events(lines, metrics.port(port)):
+                    if edge == edge_rising:
+                        analyzer.rising(gpio, timestamp)
+                        if verbose: print(format_edge_line(gpio, edge, timestamp))
+                    else:
+                        scheduler.mark_dirty('deviation', 'pairs', arrival=arrival)
+
+                        if analyzer.falling():
+                            #refresh_systime_plot(fig_systime, sys_ax, peer1_systime, peer2_systime)
+                            scheduler.mark_dirty('offset_drift', arrival=arrival)
+
+                        scheduler.mark_dirty('api', arrival=arrival)
+
                 """ if systime1 != 0 and systime2 != 0:
                     measure_time_diff = abs(systime1_measure_timestamp - systime2_measure_timestamp)
                     if systime1_measure_timestamp > systime2_measure_timestamp:
@@ -374,68 +534,62 @@ def main():
                     
                     systime1 = systime2 = 0 """
 
-
-            peer1_line = ser_peer1.readline(-1).decode().strip()
-            if 'Offset to master with' in peer1_line:
-                process_peer_comp_offset(peer1_line, peer_comp_offsets, peer_comp_offsets_time)
-            if 'Systime at' in peer1_line:
-                parts = peer1_line.split()
-                peer1_systime.append(append_time(int(parts[parts.index('at')+1])))
-            if 'avg_send_offset = ' in peer1_line:
-                parts = peer1_line.split()
-                peer1_send_offsets.append(int(parts[parts.index('=')+1]) )
-            if 'avg_recv_offset = ' in peer1_line:
-                parts = peer1_line.split()
-                peer1_recv_offsets.append(int(parts[parts.index('=')+1]) )
-
-            peer2_line = ser_peer2.readline(-1).decode().strip()
-            if 'Offset to master with' in peer2_line:
-                process_peer_comp_offset(peer2_line, peer_comp_offsets, peer_comp_offsets_time)
-            if 'Systime at' in peer2_line:
-                parts = peer2_line.split()
-                peer2_systime.append(append_time(int(parts[parts.index('at')+1])))
-            if 'avg_send_offset = ' in peer2_line:
-                parts = peer2_line.split()
-                peer2_send_offsets.append(int(parts[parts.index('=')+1]) )
-            if 'avg_recv_offset = ' in peer2_line:
-                parts = peer2_line.split()
-                peer2_recv_offsets.append(int(parts[parts.index('=')+1]) )
-
-            if 'CONFIG: ' in peer1_line and once:
-                parts = peer1_line.split()
-                subdir = parts[parts.index('CONFIG:')+1]
-                print("\nFetched CONFG: "+subdir+'\n')
-            if 'RESETTING NETWORK' in peer1_line:
-                plt.close(fig_obsv)
-                plt.close(fig_peer)
-                plt.close(fig_send_recv)
-                ser_obsv.close()
-                ser_peer1.close()
-                ser_peer2.close()
-                print('\nReset detected - aborting script\n')
-                quit()
-
-        except KeyboardInterrupt:
+            elif port in peers:
+                for line in lines:
+                    event = process_peer_line(line, host_time, peers[port])
+                    if port == 'peer1' and event is not None:
+                        if event[0] == 'peer_config' and once:
+                            subdir = event[1]
+                            print("\nFetched CONFG: "+subdir+'\n')
+                        if event[0] == 'peer_reset' and replay_path:   # every capture of a finished run ends with the reset
+                            raise EOFError(replay_path)         # same end of input as the end of the capture
+                        if event[0] == 'peer_reset':
+                            close_figures(views)
+                            stop_readers(readers)
+                            if recorder is not None: recorder.close()
+                            if headless: emitter.close(summarize())
+                            print('\n' + metrics.close())
+                            print('\nReset detected - aborting script\n')
+                            quit()
+
+            if live:
+                metrics.parsed(time.perf_counter() - parse_start, events.qsize())
+                if metrics.poll(): scheduler.mark_dirty('deviation')
+                if headless: emitter.poll(summarize)
+                scheduler.poll()
+
+        except (KeyboardInterrupt, EOFError):                           # EOFError: end of a replayed capture
             break
         except Exception as ex:
             print(ex)
-            pass
+            metrics.count_error(ex)
     
-    if save_plots:
-        parentdir = '.\\python_utils\\export'
+    scheduler.flush()                                                   # bring the figures up to date with everything ingested
+    if headless: emitter.close(summarize())
+    status = metrics.close()
+    if live: print('\n' + status)
+    if recorder is not None:
+        recorder.close()
+        print('recorded ' + str(recorder.count) + ' lines to ' + record_path)
+    if replay_path:
+        print('replayed ' + str(events.count) + ' lines from ' + replay_path)
+        events.close()
+
+    if save_plots and views:
         subdir += '_'+datetime.today().strftime('%Y-%m-%d')
-        subdir = os.path.join(parentdir, subdir)
+        subdir = os.path.join(export_dir, subdir)
         if not os.path.exists(subdir):
             os.makedirs(subdir)
-        fig_obsv.savefig(os.path.join(subdir, 'figure_measure.png'))
-        fig_peer.savefig(os.path.join(subdir, 'figure_peer.png'))
-        fig_send_recv.savefig(os.path.join(subdir, 'send_receive_delays.png'))
-    plt.close(fig_obsv)
-    plt.close(fig_peer)
-    plt.close(fig_send_recv)
-    ser_obsv.close()
-    ser_peer1.close()
-    ser_peer2.close()
+        if metrics.overlay is not None:
+            metrics.overlay.set_visible(False)                          # keep the status out of the saved figures
+        save_figures(views, subdir)
+        if recorder is not None:
+            shutil.copyfile(record_path, os.path.join(subdir, 'capture.log'))
+    elif replay_path and views:
+        pyplot().ioff()
+        pyplot().show()                                                 # keep the replayed figures open until they are closed
+    close_figures(views)
+    stop_readers(readers)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,46 +1,54 @@
 import sys
+import time
 import serial
-import re
+from serial_reader import split_lines, read_timeout
+from metrics import port_stats, format_metrics_line, metrics_interval
 
 # idea was taken from: https://stackoverflow.com/questions/27484250/python-pyserial-read-data-form-multiple-serial-ports-at-same-time
+# Drains whatever the driver buffered in one read and writes the complete, ANSI-free lines of it with one write/flush.
+# Once per metrics_interval the counters of the port go to stderr as a METRICS line, pipe_reader hands them to metrics.py.
 
 def configure_serial(port, baudrate):
     ser = serial.Serial()
     ser.baudrate = 115200
     ser.port = port
     ser.parity = 'N'
-    ser.timeout = 0.0001
+    ser.timeout = read_timeout                  # blocks for the first byte instead of spinning
     
     try:
         ser.open()
     except Exception as e:
-        sys.stderr.write(e)
+        sys.stderr.write(str(e) + '\n')
+        sys.stderr.flush()
         return None
 
     ser.baudrate = baudrate
     return ser
 
-def escape_ansi(line):
-    ansi_escape = re.compile(r'(?:\x1B[@-_]|[\x80-\x9F])[0-?]*[ -/]*[@-~]')
-    return ansi_escape.sub('', line)
-
 ser = None
 while True:
     ser = configure_serial(sys.argv[1], sys.argv[2])
     if ser != None:
         break
-    ser.close()
+    time.sleep(1)                               # board not plugged in yet, try again
 
+pending = bytearray()                           # partial line left over from the previous read
+stats = port_stats(sys.argv[1])
+last_report = time.monotonic()
 while True:  # The program never ends... will be killed when master is over.
 
-    line = ser.readline()
-    if line:
-        try:
-            line = line.decode().strip()            # read line
-        except Exception as e:
-            continue
-        
-        output = escape_ansi(line)              # clean from ansi escape codes
-        if output:
-            sys.stdout.write(output+ '\n')          # write output to stdout
+    waiting = ser.in_waiting
+    chunk = ser.read(waiting or 1)              # everything the driver buffered, at least one byte
+    if chunk:
+        stats.read(len(chunk), waiting)
+        pending += chunk
+        lines = split_lines(pending, stats)     # decoded and cleaned from ansi escape codes
+        if lines:
+            stats.lines += len(lines)
+            sys.stdout.write('\n'.join(lines) + '\n')  # write output to stdout
             sys.stdout.flush()                      # flush output
+
+    if time.monotonic() - last_report >= metrics_interval:
+        last_report = time.monotonic()
+        sys.stderr.write(format_metrics_line(stats) + '\n')
+        sys.stderr.flush()
@@ -0,0 +1,172 @@
+import os
+import io
+import json
+import numpy as np
+from datetime import datetime
+from numpy.lib import format as npy_format
+
+#
+# Columnar on-disk store for the relay results of plot_coding_data, replaces the relay_values_final.txt text format.
+# <root>/index.json lists the entries with their scalar values, every entry is a directory <native_cnt>_<date> with one
+# .npy file per series. Entries are written one at a time (temp file + os.replace), so storing one node count never
+# touches the others. Series grow in place by appending to their .npy file and patching the shape in its header,
+# loading memory-maps them instead of reading them.
+#
+
+store_dir     = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'export', 'coding_plot', 'relay_store')
+index_name    = 'index.json'
+index_version = 1
+
+def entry_key(native_cnt, date):
+    return str(native_cnt) + '_' + date
+
+class relay_store:
+
+    def __init__(self, root=store_dir):
+        self.root       = root
+        self.index_path = os.path.join(root, index_name)
+        os.makedirs(root, exist_ok=True)
+        self.index      = self.read_index()                             # {'version', 'entries': {key: {'native_cnt', 'date', 'series', scalars...}}}
+
+    def read_index(self):
+        if not os.path.exists(self.index_path):
+            return {'version': index_version, 'entries': {}}
+        with open(self.index_path, 'r') as file:
+            index = json.load(file)
+        if index.get('version', 0) > index_version:
+            raise ValueError(self.index_path + ' has index version ' + str(index['version']) + ', newest supported is ' + str(index_version))
+        return index
+
+    def write_index(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(self.index, file, indent=1)
+        os.replace(tmp_path, self.index_path)                           # readers see the old or the new index, never half of one
+
+    def keys(self, native_cnt=None):                                    # sorted by native node count, then by date
+        entries = self.index['entries']
+        keys = [key for key in entries if native_cnt is None or entries[key]['native_cnt'] == native_cnt]
+        return sorted(keys, key=lambda key: (entries[key]['native_cnt'], entries[key]['date']))
+
+    def latest(self):                                                   # native_cnt -> key of its newest run
+        latest = {}
+        for key in self.keys():
+            latest[self.index['entries'][key]['native_cnt']] = key
+        return latest
+
+    def entry(self, key):
+        return self.index['entries'][key]
+
+    def put(self, native_cnt, series, scalars={}, date=None):         # store or replace a whole entry
+        date = date or datetime.today().strftime('%Y-%m-%d')
+        key  = entry_key(native_cnt, date)
+        os.makedirs(os.path.join(self.root, key), exist_ok=True)
+
+        lengths = {}
+        for name, values in series.items():
+            values = np.ascontiguousarray(values)
+            write_series(self.series_path(key, name), values)
+            lengths[name] = len(values)
+
+        self.index['entries'][key] = dict(native_cnt=native_cnt, date=date, series=lengths, **scalars)
+        self.write_index()
+        return key
+
+    def append(self, native_cnt, series, scalars={}, date=None):      # grow the series of an entry without rewriting them
+        date = date or datetime.today().strftime('%Y-%m-%d')
+        key  = entry_key(native_cnt, date)
+        if key not in self.index['entries']:
+            return self.put(native_cnt, series, scalars, date)
+
+        entry = self.index['entries'][key]
+        for name, values in series.items():
+            path = self.series_path(key, name)
+            if name in entry['series']:
+                entry['series'][name] = append_series(path, np.ascontiguousarray(values))
+            else:
+                write_series(path, np.ascontiguousarray(values))
+                entry['series'][name] = len(values)
+        entry.update(scalars)
+        self.write_index()
+        return key
+
+    def load(self, key):                                                # series as read-only memory maps plus the scalar values
+        entry  = self.index['entries'][key]
+        values = {name: value for name, value in entry.items() if name != 'series'}
+        for name in entry['series']:
+            values[name] = load_series(self.series_path(key, name))
+        return values
+
+    def remove(self, key):
+        entry = self.index['entries'].pop(key)
+        self.write_index()
+        for name in entry['series']:
+            os.remove(self.series_path(key, name))
+        os.rmdir(os.path.join(self.root, key))
+
+    def series_path(self, key, name):
+        return os.path.join(self.root, key, name + '.npy')
+
+def write_series(path, values):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        np.save(file, values)
+    os.replace(tmp_path, path)
+
+def append_series(path, values):                                        # returns the new length
+    with open(path, 'r+b') as file:
+        version = npy_format.read_magic(file)
+        shape, fortran_order, dtype = npy_format.read_array_header_1_0(file) if version == (1, 0) else npy_format.read_array_header_2_0(file)
+        header_len = file.tell()
+
+        length = shape[0] + len(values)
+        header = io.BytesIO()                                           # numpy pads the header so the length can grow in place
+        fields = {'descr': npy_format.dtype_to_descr(dtype), 'fortran_order': fortran_order, 'shape': (length,)}
+        npy_format.write_array_header_1_0(header, fields) if version == (1, 0) else npy_format.write_array_header_2_0(header, fields)
+        if len(header.getvalue()) != header_len:                       # header written by an old numpy without padding
+            file.close()
+            write_series(path, np.concatenate([np.load(path), values.astype(dtype)]))
+            return length
+
+        file.seek(0, os.SEEK_END)
+        file.write(values.astype(dtype, copy=False).tobytes())         # data first, a crash in between leaves the old shape valid
+        file.seek(0)
+        file.write(header.getvalue())
+    return length
+
+def load_series(path):
+    try:
+        return np.load(path, mmap_mode='r')
+    except ValueError:                                                  # empty series can not be mapped
+        return np.load(path)
+
+def parse_text_file(filename):
+    # streams the old relay_values_final.txt format, yields (native_cnt, {'transm', 'cod_gain', 'cod_gain_avg', 'cod_gain_ideal'})
+    native_cnt = None
+    values     = {}
+    with open(filename, 'r') as file:
+        for line in file:
+            if line.startswith('Values for'):
+                if native_cnt is not None:
+                    yield native_cnt, values
+                native_cnt = int(line.split()[2])
+                values     = {}
+            elif line.strip() and native_cnt is not None:
+                key, text = line.strip().split(':', 1)
+                if key in ['transm', 'cod_gain']:
+                    values[key] = np.fromstring(text, dtype=float, sep=',') if text.strip() else np.empty(0)   # parsed in C, no list of strings
+                elif key in ['cod_gain_avg', 'cod_gain_ideal']:
+                    values[key] = float(text)
+    if native_cnt is not None:
+        yield native_cnt, values
+
+def import_text_file(filename, store, date=None):                      # returns the keys of the imported entries
+    date = date or datetime.fromtimestamp(os.path.getmtime(filename)).strftime('%Y-%m-%d')
+    keys = []
+    for native_cnt, values in parse_text_file(filename):
+        series  = {name: values[name] for name in ['transm', 'cod_gain'] if name in values}
+        scalars = {name: values[name] for name in ['cod_gain_avg', 'cod_gain_ideal'] if name in values}
+        if 'transm' in series:
+            series['transm'] = series['transm'].astype(np.int64)
+        keys.append(store.put(native_cnt, series, scalars, date))
+    return keys
@@ -0,0 +1,56 @@
+import collections
+
+#
+# Windowed multiset of packet sequence numbers, a drop-in for the collections.deque(maxlen=...) the coding plots
+# used to scan with `in` and remove().
+# Same semantics as the deque: entries keep their insertion order, appending to a full tracker evicts the oldest
+# entry, remove() takes out the oldest occurrence of a value. Every entry gets an increasing id, the window is an
+# ordered dict id -> seqnum and a dict seqnum -> ids of its occurrences (oldest first), so membership, append,
+# remove and eviction are O(1) no matter how long the window is.
+#
+
+class seqnum_tracker:
+
+    def __init__(self, maxlen):
+        self.maxlen  = maxlen
+        self.window  = collections.OrderedDict()                        # id -> seqnum, in insertion order
+        self.ids     = {}                                               # seqnum -> deque of its ids, oldest first
+        self.next_id = 0
+
+    def __len__(self):
+        return len(self.window)
+
+    def __contains__(self, seqnum):
+        return seqnum in self.ids
+
+    def __iter__(self):                                                 # seqnums from oldest to newest, like the deque
+        return iter(self.window.values())
+
+    def count(self, seqnum):
+        return len(self.ids.get(seqnum, ()))
+
+    def append(self, seqnum):
+        if len(self.window) == self.maxlen:                             # evict the oldest entry, it is the first id of its seqnum
+            _, oldest = self.window.popitem(last=False)
+            self._drop_first(oldest)
+        self.window[self.next_id] = seqnum
+        self.ids.setdefault(seqnum, collections.deque()).append(self.next_id)
+        self.next_id += 1
+
+    def remove(self, seqnum):                                           # oldest occurrence, ValueError if missing like deque.remove
+        if seqnum not in self.ids:
+            raise ValueError(str(seqnum) + ' is not tracked')
+        del self.window[self._drop_first(seqnum)]
+
+    def discard(self, seqnum):                                          # remove() without the error, True if something was removed
+        if seqnum not in self.ids:
+            return False
+        del self.window[self._drop_first(seqnum)]
+        return True
+
+    def _drop_first(self, seqnum):
+        ids = self.ids[seqnum]
+        first = ids.popleft()
+        if not ids:
+            del self.ids[seqnum]
+        return first
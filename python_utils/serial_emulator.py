@@ -0,0 +1,242 @@
+import sys
+import os
+import time
+import random
+import tty
+import numpy as np
+from obsv_frames import encode_frames, format_edge_line, edge_rising, edge_falling
+from sync_analyzer import obsv_gpios
+from capture import capture_reader, capture_ports
+
+#
+# Virtual ESP32 boards on pty-backed serial ports (Linux / macOS), for load-testing the collectors without hardware.
+# Run:
+# `python serial_emulator.py -sync`        # observer + peers in the log format of main/main.c, for plot_sync_data
+# `python serial_emulator.py -coding`      # relay + native nodes, for plot_coding_data
+# `python serial_emulator.py -replay FILE` # the ports and lines of a capture at their recorded pace
+# The emulator prints the port paths and the command line to start the collector with, then starts sending after -delay.
+# optional: -peers N peers (-sync, default 2, up to 7) / -natives N native nodes (-coding, default 2)
+#           -rate R cycles per second (-sync, default 1) / native packets per second (-coding, default 50)
+#           -speed X multiplies the rate, or the replay pace (default 1), e.g. -speed 10 for 10x the real line rate
+#           -drift PPM clock drift of the peers, one value per peer (comma separated) or one bound they are drawn from (default 20)
+#           -jitter US standard deviation of the peer edges around their drifted position (default 5)
+#           -config TEXT CONFIG token peer1 prints at start (default bc_duration_500-TS_senddelay_20-DS_duration_500-ME_duration_1000)
+#           -binary observer sends CONFIG_OBSERVER_BINARY_FRAMES frames instead of text lines
+#           -count N stops after N cycles / native packets, the boards then print their shutdown / network reset line (default: until Ctrl+C)
+#           -delay S seconds between opening the ports and the first line, time to start the collector (default 3)
+# Like a UART without flow control the ports never block: whatever does not fit into the pty buffer because the collector
+# does not read fast enough is dropped and counted, the per-port totals are printed at the end.
+#
+
+log_colors  = {'I': '\x1b[0;32m', 'W': '\x1b[0;33m', 'E': '\x1b[0;31m'}  # esp log levels
+log_reset   = '\x1b[0m'
+default_config = 'bc_duration_500-TS_senddelay_20-DS_duration_500-ME_duration_1000'
+
+class virtual_port:
+
+    def __init__(self, name):
+        self.name           = name
+        self.master, slave  = os.openpty()
+        tty.setraw(slave)                                               # no echo and no newline translation until the collector configures it
+        os.set_blocking(self.master, False)
+        self.path           = os.ttyname(slave)
+        self.slave          = slave                                     # kept open so the pty survives the collector reopening it
+        self.lines          = 0
+        self.written        = 0                                         # bytes
+        self.dropped        = 0                                         # bytes that did not fit into the pty buffer
+
+    def write(self, data):
+        try:
+            count = os.write(self.master, data)
+        except BlockingIOError:
+            count = 0
+        self.written += count
+        self.dropped += len(data) - count
+
+    def write_lines(self, lines):
+        if lines:
+            self.lines += len(lines)
+            self.write(''.join(lines).encode())
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+def esp_log(uptime_us, tag, message, level='I'):                        # one line as esp-idf prints it, colors included
+    return log_colors[level] + level + ' (' + str(uptime_us // 1000) + ') ' + tag + ': ' + message + log_reset + '\r\n'
+
+def peer_drifts(spec, count):                                           # ppm per peer from '-drift 20' or '-drift 10,-5,3'
+    values = [float(value) for value in spec.split(',')]
+    if len(values) == 1:
+        return [random.uniform(-values[0], values[0]) for _ in range(count)]
+    return (values * count)[:count]
+
+class sync_boards:                                                      # observer + peers, one synchronisation cycle per step
+
+    def __init__(self, peer_cnt, drifts, jitter, config, binary):
+        self.obsv    = virtual_port('obsv')
+        self.peers   = [virtual_port('peer' + str(i+1)) for i in range(peer_cnt)]
+        self.ports   = [self.obsv] + self.peers
+        self.gpios   = obsv_gpios[:peer_cnt]
+        self.drifts  = np.array(drifts) * 1e-6
+        self.jitter  = jitter
+        self.config  = config
+        self.binary  = binary
+
+    def command(self):
+        return 'python plot_sync_data.py -obsv ' + self.obsv.path + ' -peers ' + ','.join(port.path for port in self.peers) + (' -binary' if self.binary else '')
+
+    def start(self, now_us):
+        if self.config:
+            self.peers[0].write_lines([esp_log(now_us, 'SYNC', 'CONFIG: ' + self.config)])
+
+    def step(self, index, now_us, period_us):
+        # peers set their gpio at the start of the cycle as seen by their own clock: the drift accumulated since the
+        # last synchronisation plus jitter, the observer reports the rising edges in time order and the falling ones later
+        errors   = self.drifts * period_us + np.random.normal(0, self.jitter, len(self.peers))
+        rising   = (now_us + errors).astype(np.int64)
+        order    = np.argsort(rising)
+        gpio     = np.array(self.gpios)[order]
+        rising   = rising[order]
+        falling  = rising + period_us // 2
+        edges    = np.concatenate(([edge_rising] * len(gpio), [edge_falling] * len(gpio)))
+        if self.binary:
+            self.obsv.lines += 2 * len(gpio)
+            self.obsv.write(encode_frames(np.concatenate((gpio, gpio)), edges, np.concatenate((rising, falling))))
+        else:
+            self.obsv.write_lines([format_edge_line(g, e, t) + '\r\n' for g, e, t in zip(np.concatenate((gpio, gpio)).tolist(), edges.tolist(), np.concatenate((rising, falling)).tolist())])
+
+        for i, peer in enumerate(self.peers):
+            systime = int(now_us * (1 + self.drifts[i]))
+            lines   = [esp_log(systime, 'SYNC', 'Systime at ' + str(systime))]
+            if i > 0:
+                lines.append(esp_log(systime, 'SYNC', 'Offset to master with ' + str(int(errors[i] - errors[0]))))
+            lines.append(esp_log(systime, 'API', 'avg_send_offset = ' + str(random.randint(30, 50))))
+            lines.append(esp_log(systime, 'API', 'avg_recv_offset = ' + str(random.randint(30, 50))))
+            peer.write_lines(lines)
+
+    def stop(self, now_us):
+        for peer in self.peers:
+            peer.write_lines([esp_log(now_us, 'SYNC', 'RESETTING NETWORK')])
+
+class coding_boards:                                                    # relay + native nodes, one native packet per step
+
+    def __init__(self, native_cnt):
+        self.relay   = virtual_port('relay')
+        self.natives = [virtual_port('native' + str(i+1)) for i in range(native_cnt)]
+        self.ports   = [self.relay] + self.natives
+        self.pending = []                                               # (seqnum, native) received by the relay, not encoded yet
+        self.encoded = 0
+
+    def command(self):
+        return 'python plot_coding_data.py -p ' + ' '.join(port.path for port in self.ports)
+
+    def start(self, now_us):
+        pass
+
+    def step(self, index, now_us, period_us):
+        seqnum = index + 1
+        source = index % len(self.natives)
+        self.natives[source].write_lines([esp_log(now_us, 'CODING', 'Commissioned native packet ' + str(seqnum))])
+        relay_lines = [esp_log(now_us, 'CODING', 'Received native packet ' + str(seqnum))]
+
+        # the relay xors two packets of different natives into one broadcast, every native decodes the other half
+        partner = next((entry for entry in self.pending if entry[1] != source), None)
+        if partner is None:
+            self.pending.append((seqnum, source))
+        else:
+            self.pending.remove(partner)
+            self.encoded += 1
+            relay_lines.append(esp_log(now_us, 'CODING', 'Encoded packets [ ' + str(partner[0]) + ' ' + str(seqnum) + ' ]'))
+            for i, native in enumerate(self.natives):
+                lines = [esp_log(now_us, 'CODING', 'Received encoded packet')]
+                if i == source:
+                    lines.append(esp_log(now_us, 'CODING', 'Decoded packet ' + str(partner[0])))
+                elif i == partner[1]:
+                    lines.append(esp_log(now_us, 'CODING', 'Decoded packet ' + str(seqnum)))
+                native.write_lines(lines)
+            if self.encoded % 10 == 0:
+                relay_lines.append(esp_log(now_us, 'RR', 'Received reception report - data_lenght 12 packet_count 10'))
+        self.relay.write_lines(relay_lines)
+
+    def stop(self, now_us):
+        for port in self.ports:
+            port.write_lines([esp_log(now_us, 'MAIN', 'initiating shutdown task')])
+
+def run_boards(boards, rate, count, delay):
+    period_us = int(1e6 / rate)
+    print(boards.command())
+    time.sleep(delay)
+
+    start = time.perf_counter()
+    boards.start(0)
+    index = 0
+    try:
+        while count is None or index < count:
+            due = start + index / rate
+            now = time.perf_counter()
+            if due > now:
+                time.sleep(due - now)
+            boards.step(index, int((due - start) * 1e6), period_us)
+            index += 1
+    except KeyboardInterrupt:
+        pass
+    boards.stop(int((time.perf_counter() - start) * 1e6))
+    return index, time.perf_counter() - start
+
+def replay(path, speed, delay):                                         # the lines of a capture on one virtual port per captured port
+    ports = {name: virtual_port(name) for name in capture_ports(path)}
+    for port in ports.values():
+        print(port.name + ' ' + port.path)
+    time.sleep(delay)
+
+    reader = capture_reader(path)
+    origin = None
+    start  = time.perf_counter()
+    try:
+        for name, host_time, line in reader:
+            origin = host_time if origin is None else origin
+            due = start + (host_time - origin) / 1e9 / speed
+            now = time.perf_counter()
+            if due > now:
+                time.sleep(due - now)
+            ports[name].write_lines([line + '\r\n'])
+    except KeyboardInterrupt:
+        pass
+    reader.close()
+    return list(ports.values()), reader.count, time.perf_counter() - start
+
+def main():
+    args   = sys.argv
+    speed  = float(args[args.index('-speed')+1])  if '-speed'  in args else 1
+    delay  = float(args[args.index('-delay')+1])  if '-delay'  in args else 3
+    count  = int(args[args.index('-count')+1])    if '-count'  in args else None
+
+    if '-replay' in args:
+        ports, steps, seconds = replay(args[args.index('-replay')+1], speed, delay)
+        unit = 'lines'
+    elif '-coding' in args:
+        natives = int(args[args.index('-natives')+1]) if '-natives' in args else 2
+        rate    = float(args[args.index('-rate')+1])  if '-rate'    in args else 50
+        boards  = coding_boards(natives)
+        steps, seconds = run_boards(boards, rate * speed, count, delay)
+        ports, unit = boards.ports, 'native packets'
+    else:
+        peers   = int(args[args.index('-peers')+1])   if '-peers'   in args else 2
+        rate    = float(args[args.index('-rate')+1])  if '-rate'    in args else 1
+        drift   = args[args.index('-drift')+1]        if '-drift'   in args else '20'
+        jitter  = float(args[args.index('-jitter')+1]) if '-jitter' in args else 5
+        config  = args[args.index('-config')+1]       if '-config'  in args else default_config
+        boards  = sync_boards(peers, peer_drifts(drift, peers), jitter, config, '-binary' in args)
+        steps, seconds = run_boards(boards, rate * speed, count, delay)
+        ports, unit = boards.ports, 'cycles'
+
+    print('\nsent %d %s in %.1f s (%.0f/s)' % (steps, unit, seconds, steps / seconds if seconds else 0))
+    for port in ports:
+        print('%-8s %-14s %8d lines %10d bytes %10d dropped' % (port.name, port.path, port.lines, port.written, port.dropped))
+    time.sleep(delay)                                                   # let the collector drain the ports before they disappear
+    for port in ports:
+        port.close()
+
+if __name__ == '__main__':
+    main()
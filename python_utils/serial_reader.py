@@ -0,0 +1,144 @@
+import sys
+import serial
+import threading
+import queue
+import time
+import re
+from metrics import port_stats
+
+#
+# Threaded serial ingestion shared by the plot scripts.
+# Every port gets its own reader thread, all readers feed one event queue with (port name, host time, lines) tuples.
+# A reader drains everything the driver has buffered in one read, cuts the complete lines off its bytearray buffer,
+# strips the ANSI color codes of the whole block with one regex pass and queues the lines as one batch, so the
+# per-line Python overhead of readline() / decode() / escape_ansi() / queue.put() is paid once per read instead.
+# The host time is a time.monotonic_ns() stamp taken right after the bytes came off the serial object, it is shared by
+# the lines of a batch. The threads block inside the serial driver instead of busy polling, so a slow consumer never
+# delays a port.
+# Ports sending binary frames get a frame_reader instead, which queues arrays of decoded frames in place of lines.
+# Every reader counts bytes, lines, the in_waiting high-water mark and dropped data in the port_stats of its port.
+#
+
+read_timeout = 0.05                                                     # blocking read timeout [s], only bounds shutdown latency
+ansi_escape  = re.compile(r'(?:\x1B[@-_]|[\x80-\x9F])[0-?]*[ -/]*[@-~]')  # color codes of the esp log output
+ansi_escape_bytes = re.compile(rb'(?:\x1B[@-_]|\xC2[\x80-\x9F])[0-?]*[ -/]*[@-~]')   # same on raw utf-8, C1 codes are two bytes there
+
+def configure_serial(port, baudrate=921600):
+    ser = serial.Serial()
+    ser.baudrate = baudrate
+    ser.port = port
+    ser.parity = 'N'
+    ser.timeout = read_timeout
+
+    try:
+        ser.open()
+    except Exception as e:
+        print(e)
+        sys.exit()
+
+    ser.reset_input_buffer()
+    return ser
+
+def escape_ansi(line):
+    return ansi_escape.sub('', line)
+
+def split_lines(pending, stats=None):                                   # complete lines cut off the bytearray, the partial tail stays in it
+    end = pending.rfind(b'\n') + 1
+    if not end:
+        return []
+    block = ansi_escape_bytes.sub(b'', pending[:end])
+    del pending[:end]
+    try:
+        text = block.decode()
+    except UnicodeDecodeError:                                          # only drop the broken lines, like reading line by line did
+        lines = list(map(decode_line, block.split(b'\n')))
+        if stats is not None:
+            stats.decode_failures += lines.count(None)
+        return [line for line in lines if line]
+    return [line for line in map(str.strip, text.split('\n')) if line]
+
+def decode_line(raw):                                                   # None if raw is no valid utf-8
+    try:
+        return raw.decode().strip()
+    except UnicodeDecodeError:
+        return None
+
+class port_reader(threading.Thread):
+
+    def __init__(self, port_name, ser, events, stats=None):
+        super().__init__(name='reader-' + port_name, daemon=True)
+        self.port_name  = port_name                                     # name the lines are tagged with
+        self.ser        = ser                                           # opened serial.Serial object
+        self.events     = events                                        # shared queue.Queue of (port_name, host_time [ns], lines)
+        self.stats      = stats or port_stats(port_name)                # counters of the port, see metrics.py
+        self.running    = threading.Event()
+        self.running.set()
+
+    def run(self):
+        pending = bytearray()                                           # partial line left over from the previous read
+        while self.running.is_set():
+            try:
+                waiting = self.ser.in_waiting
+                chunk = self.ser.read(waiting or 1)                     # everything the driver buffered, blocks for at least one byte
+                host_time = time.monotonic_ns()                         # receive stamp, taken before any parsing
+            except serial.SerialException as e:
+                print('ERROR ' + self.port_name + ': ' + str(e))
+                break
+
+            if not chunk:
+                continue
+            self.stats.read(len(chunk), waiting)
+            pending += chunk
+            lines = split_lines(pending, self.stats)
+            if lines:
+                self.stats.lines += len(lines)
+                self.events.put((self.port_name, host_time, lines))
+
+    def stop(self):
+        self.running.clear()
+        self.join(timeout=1)
+
+class frame_reader(port_reader):                                        # binary ports, pushes whole batches of decoded frames
+
+    def __init__(self, port_name, ser, events, decode, stats=None):
+        super().__init__(port_name, ser, events, stats)
+        self.decode     = decode                                        # bytes -> (frames, consumed bytes, skipped bytes)
+
+    def run(self):
+        pending = bytearray()                                           # partial frame left over from the previous read
+        while self.running.is_set():
+            try:
+                waiting = self.ser.in_waiting
+                chunk = self.ser.read(waiting or 1)                     # everything the driver buffered, blocks for at least one byte
+                host_time = time.monotonic_ns()
+            except serial.SerialException as e:
+                print('ERROR ' + self.port_name + ': ' + str(e))
+                break
+
+            if not chunk:
+                continue
+            self.stats.read(len(chunk), waiting)
+            pending += chunk
+            frames, consumed, skipped = self.decode(pending)
+            del pending[:consumed]
+            self.stats.skipped_bytes += skipped                         # bytes dropped while resynchronising
+
+            if len(frames):
+                self.stats.lines += len(frames)
+                self.events.put((self.port_name, host_time, frames))
+
+def start_readers(serial_ports, binary_ports={}, metrics=None):         # binary_ports: port name -> frame decoder, metrics: pipeline_metrics
+    events  = queue.Queue()
+    readers = []
+    for name, ser in serial_ports.items():
+        stats = metrics.port(name) if metrics is not None else None
+        readers.append(frame_reader(name, ser, events, binary_ports[name], stats) if name in binary_ports else port_reader(name, ser, events, stats))
+    for reader in readers:
+        reader.start()
+    return events, readers
+
+def stop_readers(readers):
+    for reader in readers:
+        reader.stop()
+    for reader in readers:
+        reader.ser.close()
@@ -0,0 +1,176 @@
+import collections
+import math
+import numpy as np
+from buffers import ring_buffer, pair_dtype
+
+#
+# Streaming statistics for the live plots.
+# The estimators are updated per sample and evict the oldest sample once their window is full,
+# so a refresh costs the same no matter how long the measurement window is.
+# The windows are numpy ring buffers, the samples are handed to the plots as arrays without a conversion per refresh.
+#
+
+histogram_dtype = np.dtype([('value', np.float64), ('q', np.int64)])   # sample and its quantized value
+
+class running_linreg:
+
+    def __init__(self, maxlen):
+        self.samples = ring_buffer(maxlen, pair_dtype)                   # (x, y) pairs inside the window
+        self.x0      = None                                             # origin the sums are kept relative to, keeps them small
+        self.y0      = None
+        self.n       = 0
+        self.sx      = 0                                                # running sums, python ints so they stay exact
+        self.sy      = 0
+        self.sxx     = 0
+        self.sxy     = 0
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, index):                                       # (x, y) as python ints
+        return self.samples[index].item()
+
+    def append(self, x, y):
+        if len(self.samples) == self.samples.maxlen:                    # the ring is about to overwrite its oldest sample
+            self._update(*self.samples[0].item(), -1)
+        if self.x0 is None:
+            self.x0, self.y0 = x, y
+        self.samples.append((x, y))
+        self._update(x, y, 1)
+
+    def _update(self, x, y, sign):
+        dx = x - self.x0
+        dy = y - self.y0
+        self.n   += sign
+        self.sx  += sign * dx
+        self.sy  += sign * dy
+        self.sxx += sign * dx * dx
+        self.sxy += sign * dx * dy
+
+    def slope(self):
+        den = self.n * self.sxx - self.sx * self.sx
+        if den == 0: return 0.0
+        return (self.n * self.sxy - self.sx * self.sy) / den
+
+    def intercept(self, origin=0):                                      # value of the fitted line at x = origin
+        if self.n == 0: return 0.0
+        slope = self.slope()
+        return self.y0 + (self.sy - slope * self.sx) / self.n + slope * (origin - self.x0)
+
+    def poly(self, origin=0):                                           # fit as np.poly1d over x - origin, same as np.polyfit(x - origin, y, 1)
+        return np.poly1d([self.slope(), self.intercept(origin)])
+
+    def arrays(self):                                                   # window as int64 arrays (x, y), only needed for plotting
+        xy = self.samples.values()
+        return xy['x'], xy['y']
+
+class windowed_histogram:
+
+    def __init__(self, maxlen, bins=100, resolution=1):
+        self.samples    = ring_buffer(maxlen, histogram_dtype)           # (value, quantized value) pairs inside the window
+        self.bins       = bins + bins % 2                               # even, so two neighbouring bins can always be merged
+        self.resolution = resolution                                    # smallest bin width in units of the samples
+        self.counts     = np.zeros(self.bins, dtype=np.int64)
+        self.lo         = 0                                             # left edge and bin width in multiples of the resolution,
+        self.width      = 1                                             # integers so merged bins nest exactly
+        self.sum        = 0
+        self.seq        = 0                                             # insertion counter, identifies samples in the min/max queues
+        self.min_queue  = collections.deque()                           # (seq, value) with increasing values, front is the window min
+        self.max_queue  = collections.deque()                           # (seq, value) with decreasing values, front is the window max
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, index):
+        return self.samples[index]['value']
+
+    def __iter__(self):
+        return iter(self.values())
+
+    def values(self):                                                   # window oldest first as a float64 array
+        return self.samples.values()['value']
+
+    def append(self, value):
+        if len(self.samples) == self.samples.maxlen:                    # the ring is about to overwrite its oldest sample
+            self._evict(*self.samples[0].item())
+
+        q = math.floor(value / self.resolution)
+        if not self.samples and not self.counts.any():
+            self.lo = q - self.bins // 2
+        while q < self.lo:                                              # grow to the left, old range becomes the upper half
+            self._merge(upper=True)
+        while q >= self.lo + self.bins * self.width:                    # grow to the right, old range becomes the lower half
+            self._merge(upper=False)
+
+        self.samples.append((value, q))
+        self.counts[(q - self.lo) // self.width] += 1
+        self.sum += value
+
+        self.seq += 1
+        while self.min_queue and self.min_queue[-1][1] >= value:
+            self.min_queue.pop()
+        self.min_queue.append((self.seq, value))
+        while self.max_queue and self.max_queue[-1][1] <= value:
+            self.max_queue.pop()
+        self.max_queue.append((self.seq, value))
+
+        if self.span() * 4 < self.bins * self.width and self.width > 1: # data only covers a few bins, rebuild a finer grid
+            self._rebuild()
+
+    def _evict(self, value, q):
+        self.counts[(q - self.lo) // self.width] -= 1
+        self.sum -= value
+        oldest = self.seq - len(self.samples) + 1
+        if self.min_queue[0][0] == oldest: self.min_queue.popleft()
+        if self.max_queue[0][0] == oldest: self.max_queue.popleft()
+
+    def _merge(self, upper):
+        half   = self.bins // 2
+        merged = self.counts[0::2] + self.counts[1::2]
+        self.counts[:] = 0
+        if upper:
+            self.counts[half:] = merged
+            self.lo -= self.bins * self.width
+        else:
+            self.counts[:half] = merged
+        self.width *= 2
+
+    def span(self):                                                     # quantized range covered by the window
+        return math.floor(self.max() / self.resolution) - math.floor(self.min() / self.resolution) + 1
+
+    def _rebuild(self):                                                 # O(n), only runs after the range shrank by 4x
+        self.width = 1
+        while self.bins * self.width < 2 * self.span():
+            self.width *= 2
+        lo_q = math.floor(self.min() / self.resolution)
+        self.lo = lo_q - (lo_q % self.width) - (self.bins // 4) * self.width
+        quantized = self.samples.values()['q']
+        self.counts[:] = np.bincount((quantized - self.lo) // self.width, minlength=self.bins)
+
+    def min(self):
+        return self.min_queue[0][1] if self.min_queue else 0
+
+    def max(self):
+        return self.max_queue[0][1] if self.max_queue else 0
+
+    def mean(self):
+        return self.sum / len(self.samples) if self.samples else 0
+
+    def edges(self):
+        return (self.lo + self.width * np.arange(self.bins + 1)) * self.resolution
+
+    def density(self):                                                  # same normalisation as np.histogram(..., density=True)
+        if not self.samples:
+            return np.zeros(self.bins)
+        return self.counts / (len(self.samples) * self.width * self.resolution)
+
+    def percentile(self, q):                                            # interpolated inside the bin, exact up to one bin width
+        if not self.samples:
+            return 0
+        rank   = q / 100 * len(self.samples)
+        cumul  = np.cumsum(self.counts)
+        index  = min(int(np.searchsorted(cumul, rank)), self.bins - 1)
+        before = cumul[index - 1] if index > 0 else 0
+        inside = (rank - before) / self.counts[index] if self.counts[index] else 0
+        value  = (self.lo + (index + inside) * self.width) * self.resolution
+        return min(max(value, self.min()), self.max())
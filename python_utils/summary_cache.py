@@ -0,0 +1,73 @@
+import os
+import json
+import hashlib
+
+#
+# Summary statistics of a recorded run, cached next to its capture as <capture>.summary.json.
+# An entry is only valid for the exact capture bytes (blake2b hash) and the analysis_version it was computed with, bump
+# analysis_version whenever sync_summary / coding_summary or the statistics behind them change. Every analysis parameter
+# set (e.g. the -measure window) is a separate entry. The hash is only recomputed when size or mtime of the capture
+# changed, so looking up a cached summary costs one stat() and one small json file.
+#
+
+analysis_version = 2
+cache_suffix     = '.summary.json'
+hash_chunk       = 1 << 20                                              # bytes hashed per read
+
+def data_hash(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(hash_chunk), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def params_key(params):                                                 # {'measure_cnt': 1000} -> 'measure_cnt=1000'
+    return ','.join(name + '=' + str(params[name]) for name in sorted(params))
+
+class summary_cache:
+
+    def __init__(self, capture_path):
+        self.capture_path = capture_path
+        self.path         = capture_path + cache_suffix
+        self.data         = self.read()                                 # {'version', 'hash', 'size', 'mtime_ns', 'summaries': {params key: summary}}
+
+    def read(self):
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, 'r') as file:
+                return json.load(file)
+        except ValueError:                                              # half written by an interrupted run, start over
+            return None
+
+    def current_hash(self):                                             # hash of the capture, reused while size and mtime are unchanged
+        stat = os.stat(self.capture_path)
+        data = self.data
+        if data is not None and data.get('size') == stat.st_size and data.get('mtime_ns') == stat.st_mtime_ns:
+            return data['hash'], stat
+        return data_hash(self.capture_path), stat
+
+    def get(self, params):                                              # cached summary or None if missing or invalidated
+        if self.data is None or self.data.get('version') != analysis_version:
+            return None
+        digest, stat = self.current_hash()
+        if digest != self.data['hash']:
+            return None
+        if self.data.get('mtime_ns') != stat.st_mtime_ns:               # touched but unchanged, skip the hash next time
+            self.write(stat)
+        return self.data['summaries'].get(params_key(params))
+
+    def put(self, params, summary):
+        digest, stat = self.current_hash()
+        if self.data is None or self.data.get('version') != analysis_version or self.data.get('hash') != digest:
+            self.data = {'version': analysis_version, 'hash': digest, 'summaries': {}}
+        self.data['summaries'][params_key(params)] = summary
+        self.write(stat)
+
+    def write(self, stat):                                              # stat of the capture the hash belongs to
+        self.data['size']     = stat.st_size
+        self.data['mtime_ns'] = stat.st_mtime_ns
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(self.data, file, indent=1)
+        os.replace(tmp_path, self.path)
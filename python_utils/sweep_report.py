@@ -0,0 +1,76 @@
+import sys
+import os
+import time
+import numpy as np
+from batch_analyze import find_captures, parse_args, summarize, write_summary, config_fields
+import matplotlib.pyplot as plt                                         # Agg, selected by batch_analyze
+
+#
+# Parameter-sweep report over the recorded plot_sync_data runs.
+# Run:
+# `python sweep_report.py [RUN ...]`       # same runs and options as batch_analyze, without runs every capture.log below .\export
+# The per-run summaries come from batch_analyze, only runs without an up to date summary are analyzed again.
+# Every CONFIG parameter (bc_duration, TS_senddelay, DS_duration, ME_duration, ...) that takes more than one value across
+# the runs gets DIR\sweep_<parameter>.png: mean, p99 and max Δt against the parameter on top, the estimated and the
+# computed clock drift [ppm] below, one marker per run and a line through the average of every parameter value.
+# DIR\sweep.csv / sweep.json list the runs sorted by their parameters.
+#
+
+dt_metrics    = [('dt_mean', 'mean', 'b'), ('dt_p99', 'p99', 'tab:orange'), ('dt_max', 'max', 'r')]
+drift_metrics = [('estimated_drift_ppm', 'estimated', 'g'), ('computed_drift_ppm', 'computed', 'm')]
+sweep_name    = 'sweep'
+
+def value_means(x, y):                                                  # (parameter values, average of y per value), runs without y are skipped
+    valid = np.isfinite(y)
+    values, inverse = np.unique(x[valid], return_inverse=True)
+    if len(values) == 0:
+        return values, values
+    return values, np.bincount(inverse, weights=y[valid]) / np.bincount(inverse)
+
+def plot_sweep(rows, parameter, path):
+    rows = [row for row in rows if parameter in row]
+    x    = np.array([row[parameter] for row in rows], dtype=np.float64)
+
+    fig, (dt_ax, drift_ax) = plt.subplots(2, 1, figsize=(10, 8), sharex=True)
+    for ax, metrics in ((dt_ax, dt_metrics), (drift_ax, drift_metrics)):
+        for field, label, color in metrics:
+            y = np.array([row.get(field, np.nan) for row in rows], dtype=np.float64)
+            ax.plot(x, y, 'o', color=color, alpha=0.4)
+            ax.plot(*value_means(x, y), '-', color=color, label=label)
+        ax.legend(loc='upper left')
+        ax.grid(True)
+
+    dt_ax.set_title('time deviation and clock drift against ' + parameter + ' (' + str(len(rows)) + ' runs)')
+    dt_ax.set_ylabel('\u0394t [\u00b5s]')
+    drift_ax.set_ylabel('clock drift [ppm]')
+    drift_ax.set_xlabel(parameter)
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+
+def main():
+    paths, options = parse_args(sys.argv[1:])
+    captures = find_captures(paths)
+    out_dir  = options.pop('out_dir')
+    os.makedirs(out_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    rows  = summarize(captures, out_dir, **options).values()
+    rows  = [row for row in rows if row.get('tool') == 'plot_sync_data' and 'error' not in row]
+    if not rows:
+        print('no analyzed plot_sync_data runs')
+        return
+
+    parameters = []
+    for row in rows:
+        parameters += [name for name in config_fields(row['config']) if name not in parameters]
+    rows.sort(key=lambda row: [row.get(name, 0) for name in parameters] + [row['run']])
+    write_summary(rows, out_dir, sweep_name)
+
+    swept = [name for name in parameters if len(set(row[name] for row in rows if name in row)) > 1]
+    for parameter in swept:
+        plot_sweep(rows, parameter, os.path.join(out_dir, sweep_name + '_' + parameter + '.png'))
+    print('swept %s over %d runs in %.1f s, report in %s' % (', '.join(swept) or 'no parameter', len(rows), time.perf_counter() - start, out_dir))
+
+if __name__ == '__main__':
+    main()
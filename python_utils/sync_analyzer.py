@@ -0,0 +1,77 @@
+import numpy as np
+from streaming_stats import windowed_histogram
+
+#
+# Per-cycle grouping of the observer edges for any number of peers.
+# Every peer drives one of the observer GPIOs, a cycle starts with the first rising edge after a falling edge.
+# The first rising edge of every GPIO goes into a fixed slot of the open cycle, so ingesting an edge costs the same
+# for 2 or 7 peers. Once a cycle is closed its slots become one row of a window, the spread (latest - earliest peer)
+# and the pairwise deviations of all GPIO pairs are then computed with array operations over whole rows and columns.
+#
+
+obsv_gpios = [18, 19, 21, 22, 23, 32, 33]                               # gpio_list of main/main.c
+
+class cycle_analyzer:
+
+    def __init__(self, maxlen, bins=100, gpios=obsv_gpios, verbose=True):
+        self.gpios      = list(gpios)
+        self.slots      = {gpio: i for i, gpio in enumerate(self.gpios)} # gpio number -> column
+        self.current    = np.full(len(self.gpios), np.nan)              # first rising edge per gpio of the open cycle [us]
+        self.history    = np.full((maxlen, len(self.gpios)), np.nan)    # closed cycles relative to their earliest edge, ring buffer
+        self.head       = 0                                             # next row of history
+        self.filled     = 0                                             # valid rows of history
+        self.cycles     = 0                                             # closed cycles, including the discarded first one
+        self.spread     = windowed_histogram(maxlen, bins=bins)         # latest - earliest rising edge per cycle [us]
+        self.new_cycle  = True
+        self.pairs      = np.triu_indices(len(self.gpios), 1)           # (i, j) columns of every gpio pair
+        self.verbose    = verbose                                       # print every closed cycle
+
+    def rising(self, gpio, timestamp):
+        if self.new_cycle:
+            self.close_cycle()
+            self.new_cycle = False
+        slot = self.slots.get(gpio)
+        if slot is not None and np.isnan(self.current[slot]):           # later edges of the same gpio are bounces
+            self.current[slot] = timestamp
+
+    def falling(self):                                                  # True if this edge ended an open cycle
+        was_open = not self.new_cycle
+        self.new_cycle = True
+        return was_open
+
+    def close_cycle(self):
+        seen = ~np.isnan(self.current)
+        if seen.sum() > 1:
+            self.cycles += 1
+            start  = self.current[seen].min()
+            spread = int(self.current[seen].max() - start)
+            if self.verbose:
+                print('found delta t = ' + str(spread))
+                print('------------------')
+            if self.cycles > 1:                                         # the first cycle is garbage, the observer started mid-cycle
+                self.spread.append(spread)
+                self.history[self.head] = self.current - start
+                self.head   = (self.head + 1) % len(self.history)
+                self.filled = min(self.filled + 1, len(self.history))
+        self.current[:] = np.nan
+
+    def rows(self):                                                     # closed cycles in the window, oldest first not guaranteed
+        return self.history[:self.filled] if self.filled < len(self.history) else self.history
+
+    def active(self):                                                   # gpios with at least one edge in the window
+        return ~np.isnan(self.rows()).all(axis=0)
+
+    def pair_deviation(self):                                           # (mean, max) of |t_i - t_j| per gpio pair as symmetric matrices [us]
+        rows  = self.rows()
+        i, j  = self.pairs
+        delta = np.abs(rows[:, i] - rows[:, j])                         # (cycles, pairs), nan where one of the two is missing
+        valid = ~np.isnan(delta)
+        cnt   = valid.sum(axis=0)
+        total = np.where(valid, delta, 0).sum(axis=0)
+        peak  = np.where(valid, delta, -np.inf).max(axis=0, initial=-np.inf)
+
+        mean = np.full((len(self.gpios), len(self.gpios)), np.nan)
+        high = np.full((len(self.gpios), len(self.gpios)), np.nan)
+        mean[i, j] = mean[j, i] = np.where(cnt > 0, total / np.maximum(cnt, 1), np.nan)
+        high[i, j] = high[j, i] = np.where(cnt > 0, peak, np.nan)
+        return mean, high